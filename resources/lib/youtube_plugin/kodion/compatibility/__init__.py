@@ -9,6 +9,7 @@
 
 __all__ = (
     'BaseHTTPRequestHandler',
+    'MutableMapping',
     'TCPServer',
     'byte_string_type',
     'cpu_count',
@@ -33,6 +34,7 @@ __all__ = (
 
 # Kodi v19+ and Python v3.x
 try:
+    from collections.abc import MutableMapping
     from html import unescape
     from http.server import BaseHTTPRequestHandler
     from socketserver import TCPServer
@@ -63,6 +65,7 @@ try:
 # Compatibility shims for Kodi v18 and Python v2.7
 except ImportError:
     from BaseHTTPServer import BaseHTTPRequestHandler
+    from collections import MutableMapping
     from contextlib import contextmanager as _contextmanager
     from multiprocessing import cpu_count
     from SocketServer import TCPServer
@@ -56,6 +56,7 @@ REFRESH_CONTAINER = 'refresh_container'
 RELOAD_ACCESS_MANAGER = 'reload_access_manager'
 REROUTE = 'reroute'
 SLEEPING = 'sleeping'
+STORAGE_MAINTENANCE = 'storage_maintenance'
 SUBSCRIPTION_ID = 'subscription_id'
 SWITCH_PLAYER_FLAG = 'switch_player'
 VIDEO_ID = 'video_id'
@@ -92,6 +93,7 @@ __all__ = (
     'RESOURCE_PATH',
     'REROUTE',
     'SLEEPING',
+    'STORAGE_MAINTENANCE',
     'SUBSCRIPTION_ID',
     'SWITCH_PLAYER_FLAG',
     'TEMP_PATH',
@@ -73,6 +73,7 @@ LOCATION = 'youtube.location'  # (str)
 LOCATION_RADIUS = 'youtube.location.radius'  # (int)
 
 PLAY_COUNT_MIN_PERCENT = 'kodion.play_count.percent'  # (int)
+PLAYLIST_PREFETCH_PERCENT = 'kodion.playlist.prefetch.percent'  # (int)
 
 VERIFY_SSL = 'requests.ssl.verify'  # (bool)
 CONNECT_TIMEOUT = 'requests.timeout.connect'  # (int)
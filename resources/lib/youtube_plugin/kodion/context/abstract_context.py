@@ -454,6 +454,9 @@ class AbstractContext(object):
     def get_listitem_info(detail_name):
         raise NotImplementedError()
 
+    def release_storage(self):
+        pass
+
     def tear_down(self):
         pass
 
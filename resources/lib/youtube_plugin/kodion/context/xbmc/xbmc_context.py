@@ -28,12 +28,14 @@ from ...constants import (
     ABORT_FLAG,
     ADDON_ID,
     CONTENT_TYPE,
+    STORAGE_MAINTENANCE,
     WAKEUP,
     content,
     sort,
 )
 from ...player import XbmcPlayer, XbmcPlaylist
 from ...settings import XbmcPluginSettings
+from ...sql_store import FunctionCache, Storage
 from ...ui import XbmcContextUI
 from ...utils import (
     current_system_version,
@@ -746,7 +748,16 @@ class XbmcContext(AbstractContext):
     def get_listitem_info(detail_name):
         return xbmc.getInfoLabel('Container.ListItem(0).' + detail_name)
 
+    def release_storage(self):
+        FunctionCache.wait_for_revalidation()
+        Storage.close_all()
+        maintenance_queue = Storage.pop_maintenance_queue()
+        if maintenance_queue:
+            self.send_notification(STORAGE_MAINTENANCE,
+                                   sorted(maintenance_queue))
+
     def tear_down(self):
+        self.release_storage()
         self.clear_settings()
         attrs = (
             '_addon',
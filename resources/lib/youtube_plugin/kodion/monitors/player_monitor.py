@@ -13,7 +13,7 @@ import json
 import re
 import threading
 
-from ..compatibility import xbmc
+from ..compatibility import parse_qsl, urlsplit, xbmc
 from ..constants import (
     BUSY_FLAG,
     PLAYBACK_STARTED,
@@ -101,6 +101,7 @@ class PlayerMonitorThread(threading.Thread):
 
         access_manager = self._context.get_access_manager()
         settings = self._context.get_settings()
+        prefetch_percent = settings.get_playlist_prefetch_percent()
 
         video_id_param = 'video_id=%s' % self.video_id
         report_url = use_remote_history and playback_stats.get('watchtime_url')
@@ -141,6 +142,13 @@ class PlayerMonitorThread(threading.Thread):
                     continue
                 player.stop()
 
+            if (prefetch_percent
+                    and 100 * played_time >= prefetch_percent * total_time):
+                prefetch_percent = 0
+                prefetch_thread = threading.Thread(target=self.prefetch_next)
+                prefetch_thread.daemon = True
+                prefetch_thread.start()
+
             if waited >= report_period:
                 waited = 0
 
@@ -277,6 +285,35 @@ class PlayerMonitorThread(threading.Thread):
 
         self.end()
 
+    def prefetch_next(self):
+        """
+        Loads the stream list of the next item in the video playlist, if it is
+        a video played by this addon. The stream list, and the MPEG-DASH
+        manifest, are cached so that playback of the next item can start
+        without waiting for them to be loaded.
+        """
+        playlist = xbmc.PlayList(xbmc.PLAYLIST_VIDEO)
+        position = playlist.getposition()
+        if position < 0 or position + 1 >= playlist.size():
+            return
+
+        path = playlist[position + 1].getPath()
+        if not self._context.is_plugin_path(path, 'play'):
+            return
+        video_id = dict(parse_qsl(urlsplit(path).query)).get('video_id')
+        if not video_id or video_id == self.video_id:
+            return
+
+        self._context.log_debug('PlayerMonitorThread[{0}]: Prefetching |{1}|'
+                                .format(self.video_id, video_id))
+        client = self._provider.get_client(self._context)
+        try:
+            client.get_video_streams(self._context, video_id, prefetch=True)
+        except Exception as exc:
+            self._context.log_error('PlayerMonitorThread[{0}]: Prefetch failed'
+                                    ' |{1}| - {2}'
+                                    .format(self.video_id, video_id, exc))
+
     def stop(self):
         self._context.log_debug('PlayerMonitorThread[{0}]: Stop event set'
                                 .format(self.video_id))
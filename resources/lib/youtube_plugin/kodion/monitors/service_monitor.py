@@ -11,6 +11,7 @@ from __future__ import absolute_import, division, unicode_literals
 
 import json
 import threading
+import time
 
 from ..compatibility import xbmc, xbmcgui
 from ..constants import (
@@ -19,16 +20,20 @@ from ..constants import (
     PLAYBACK_INIT,
     REFRESH_CONTAINER,
     RELOAD_ACCESS_MANAGER,
+    STORAGE_MAINTENANCE,
     WAKEUP,
 )
 from ..logger import log_debug
 from ..network import get_connect_address, get_http_server, httpd_status
+from ..sql_store import Storage
 
 
 class ServiceMonitor(xbmc.Monitor):
     _settings_changes = 0
     _settings_state = None
 
+    MAINTENANCE_INTERVAL = Storage.ONE_HOUR
+
     def __init__(self, context):
         self._context = context
         settings = context.get_settings()
@@ -46,6 +51,10 @@ class ServiceMonitor(xbmc.Monitor):
         self.refresh = False
         self.interrupt = False
 
+        self._maintenance_lock = threading.Lock()
+        self._maintenance_queue = set()
+        self._maintenance_next = 0
+
         if self._use_httpd:
             self.start_httpd()
 
@@ -108,6 +117,43 @@ class ServiceMonitor(xbmc.Monitor):
         elif event == RELOAD_ACCESS_MANAGER:
             self._context.reload_access_manager()
             self.refresh_container()
+        elif event == STORAGE_MAINTENANCE:
+            if not isinstance(data, (dict, list)):
+                data = json.loads(data)
+            if data:
+                with self._maintenance_lock:
+                    self._maintenance_queue.update(data)
+
+    def run_maintenance(self):
+        context = self._context
+        targets = {
+            'bookmarks.sqlite': context.get_bookmarks_list,
+            'cache.sqlite': context.get_function_cache,
+            'data_cache.sqlite': context.get_data_cache,
+            'feeds.sqlite': context.get_feed_history,
+            'history.sqlite': context.get_playback_history,
+            'search.sqlite': context.get_search_history,
+            'watch_later.sqlite': context.get_watch_later_list,
+        }
+
+        now = time.time()
+        with self._maintenance_lock:
+            queue = self._maintenance_queue
+            queue.update(Storage.pop_maintenance_queue())
+            if now >= self._maintenance_next:
+                self._maintenance_next = now + self.MAINTENANCE_INTERVAL
+                queue.update(targets)
+            if not queue:
+                return
+            self._maintenance_queue = set()
+
+        for target in sorted(queue):
+            if target not in targets:
+                continue
+            storage = targets[target]()
+            if storage.maintenance():
+                log_debug('Storage maintenance: |{0}| pruned to {1}KB'
+                          .format(target, storage.get_used_size() // 1024))
 
     def onSettingsChanged(self):
         self._settings_changes += 1
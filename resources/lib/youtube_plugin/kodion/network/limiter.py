@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+
+    Copyright (C) 2024-present plugin.video.youtube
+
+    SPDX-License-Identifier: GPL-2.0-only
+    See LICENSES/GPL-2.0-only for more information.
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+from threading import Condition
+
+
+class AdaptiveLimiter(object):
+    """
+    Limits the number of concurrent requests using additive increase,
+    multiplicative decrease (AIMD). The limit grows by about one for each
+    limit's worth of successful requests while latency stays near the running
+    average, and is cut when requests are throttled, time out, or latency
+    spikes.
+    """
+
+    def __init__(self,
+                 initial=4,
+                 minimum=1,
+                 maximum=10,
+                 backoff=0.5,
+                 latency_tolerance=2.0):
+        self._cond = Condition()
+        self._limit = float(initial)
+        self._minimum = minimum
+        self._maximum = maximum
+        self._backoff = backoff
+        self._latency_tolerance = latency_tolerance
+        self._latency = None
+        self._in_flight = 0
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    def acquire(self):
+        with self._cond:
+            while self._in_flight >= int(self._limit):
+                self._cond.wait()
+            self._in_flight += 1
+
+    def release(self, latency=None, throttled=False):
+        with self._cond:
+            self._in_flight -= 1
+            limit = self._limit
+            average = self._latency
+
+            if throttled:
+                limit *= self._backoff
+            elif latency is not None:
+                if average is None:
+                    average = latency
+                if latency > average * self._latency_tolerance:
+                    limit *= self._backoff
+                else:
+                    limit += 1 / limit
+                # Exponentially weighted moving average
+                average += (latency - average) / 8
+
+            self._latency = average
+            self._limit = min(max(limit, self._minimum), self._maximum)
+            self._cond.notify_all()
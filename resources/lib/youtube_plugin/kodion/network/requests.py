@@ -10,13 +10,24 @@
 from __future__ import absolute_import, division, unicode_literals
 
 import atexit
+from hashlib import md5
+from threading import Lock
+from time import time
 from traceback import format_stack
 
 from requests import Session
 from requests.adapters import HTTPAdapter, Retry
-from requests.exceptions import InvalidJSONError, RequestException
+from requests.exceptions import (
+    ConnectionError,
+    InvalidJSONError,
+    RequestException,
+    Timeout,
+)
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 
-from ..logger import log_error
+from .limiter import AdaptiveLimiter
+from ..compatibility import urlsplit
+from ..logger import log_debug, log_error
 from ..settings import XbmcPluginSettings
 
 
@@ -26,22 +37,99 @@ __all__ = (
 )
 
 
+class _PoolStatsMixin(object):
+    """
+    Records how long requests wait to get a connection from the pool, and the
+    peak number of connections in use, for each host
+    """
+
+    stats = {}
+    stats_lock = Lock()
+
+    def _get_conn(self, timeout=None):
+        start_time = time()
+        conn = super(_PoolStatsMixin, self)._get_conn(timeout)
+        wait = time() - start_time
+
+        pool = self.pool
+        in_use = (pool.maxsize - pool.qsize()) if pool else 0
+        with self.stats_lock:
+            stats = self.stats.get(self.host)
+            if not stats:
+                stats = self.stats[self.host] = {
+                    'maxsize': pool.maxsize if pool else 0,
+                    'requests': 0,
+                    'wait_total': 0,
+                    'wait_max': 0,
+                    'in_use_max': 0,
+                }
+            stats['requests'] += 1
+            stats['wait_total'] += wait
+            if wait > stats['wait_max']:
+                stats['wait_max'] = wait
+            if in_use > stats['in_use_max']:
+                stats['in_use_max'] = in_use
+        return conn
+
+
+class _StatsHTTPConnectionPool(_PoolStatsMixin, HTTPConnectionPool):
+    pass
+
+
+class _StatsHTTPSConnectionPool(_PoolStatsMixin, HTTPSConnectionPool):
+    pass
+
+
+class _StatsHTTPAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super(_StatsHTTPAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _StatsHTTPConnectionPool,
+            'https': _StatsHTTPSConnectionPool,
+        }
+
+
 class BaseRequestsClass(object):
-    _http_adapter = HTTPAdapter(
-        pool_maxsize=10,
-        pool_block=True,
-        max_retries=Retry(
-            total=3,
-            backoff_factor=0.1,
-            status_forcelist={500, 502, 503, 504},
-            allowed_methods=None,
-        )
+    # Maximum number of connections kept open, and in use at the same time,
+    # for each host matching the URL prefix. The longest prefix is used.
+    _pool_sizes = {
+        # Default for all other hosts e.g. googlevideo.com, ytimg.com
+        'https://': 10,
+        # InnerTube requests and subscription RSS feeds, which are fetched
+        # using up to 32 threads in YouTube.get_my_subscriptions
+        'https://www.youtube.com/': 32,
+        # Data API v3 requests
+        'https://www.googleapis.com/': 10,
+    }
+    _max_retries = Retry(
+        total=3,
+        backoff_factor=0.1,
+        status_forcelist={500, 502, 503, 504},
+        allowed_methods=None,
     )
 
     _session = Session()
-    _session.mount('https://', _http_adapter)
+    for _prefix, _pool_size in _pool_sizes.items():
+        _session.mount(_prefix, _StatsHTTPAdapter(
+            pool_maxsize=_pool_size,
+            pool_block=True,
+            max_retries=_max_retries,
+        ))
+    del _prefix, _pool_size
     atexit.register(_session.close)
 
+    # Adaptive limits on the number of concurrent requests to each host.
+    # The limit starts at initial and stays between minimum and maximum.
+    _concurrency = {
+        # Default for all other hosts
+        None: {'initial': 4, 'minimum': 1, 'maximum': 10},
+        'www.youtube.com': {'initial': 8, 'minimum': 2, 'maximum': 32},
+        'www.googleapis.com': {'initial': 4, 'minimum': 1, 'maximum': 10},
+    }
+    _throttled_status_codes = {429, 503}
+    _limiters = {}
+    _limiters_lock = Lock()
+
     def __init__(self, exc_type=None):
         settings = XbmcPluginSettings()
         self._verify = settings.verify_ssl()
@@ -55,6 +143,73 @@ class BaseRequestsClass(object):
         else:
             self._default_exc = (RequestException,)
 
+    @staticmethod
+    def get_pool_stats():
+        """
+        Returns a dict of connection pool stats for each host, including the
+        total and max time waited for a connection, and the max number of
+        connections in use at the same time
+        """
+        with _PoolStatsMixin.stats_lock:
+            stats = {
+                host: dict(stats)
+                for host, stats in _PoolStatsMixin.stats.items()
+            }
+        for host, limiter in BaseRequestsClass._limiters.items():
+            if host in stats:
+                stats[host]['concurrency_limit'] = limiter.limit
+        return stats
+
+    @classmethod
+    def _get_limiter(cls, url):
+        host = urlsplit(url).hostname
+        limiter = cls._limiters.get(host)
+        if limiter:
+            return limiter
+        with cls._limiters_lock:
+            limiter = cls._limiters.get(host)
+            if not limiter:
+                config = cls._concurrency.get(host) or cls._concurrency[None]
+                limiter = cls._limiters[host] = AdaptiveLimiter(**config)
+        return limiter
+
+    @staticmethod
+    def get_validators(response):
+        """
+        Returns a dict of the cache validators (ETag and Last-Modified headers)
+        of a response, or None if the response did not include any
+        """
+        headers = getattr(response, 'headers', None)
+        if not headers:
+            return None
+        etag = headers.get('ETag')
+        last_modified = headers.get('Last-Modified')
+        if not etag and not last_modified:
+            return None
+        return {
+            'etag': etag,
+            'last_modified': last_modified,
+        }
+
+    @staticmethod
+    def _conditional_headers(headers, validators):
+        headers = dict(headers) if headers else {}
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+        return headers
+
+    @staticmethod
+    def _get_cache_key(url, params, headers):
+        md5_hash = md5()
+        md5_hash.update(url.encode('utf-8'))
+        if params:
+            md5_hash.update(repr(sorted(params.items())).encode('utf-8'))
+        if headers and 'Authorization' in headers:
+            md5_hash.update(headers['Authorization'].encode('utf-8'))
+        return 'request,' + md5_hash.hexdigest()
+
     def __enter__(self):
         return self
 
@@ -72,6 +227,15 @@ class BaseRequestsClass(object):
                 response_hook_kwargs=None,
                 error_hook=None,
                 error_hook_kwargs=None,
+                # Conditional request support
+                # validators: dict of ETag and Last-Modified values of a
+                #   previous response, as returned by get_validators. The
+                #   caller handles any 304 Not Modified response.
+                # cache: Storage used to save the validators and body of GET
+                #   responses. A 304 Not Modified response is replaced with
+                #   the cached body and status.
+                validators=None,
+                cache=None,
                 error_title=None, error_info=None, raise_exc=False, **_):
         if timeout is None:
             timeout = self._timeout
@@ -80,7 +244,20 @@ class BaseRequestsClass(object):
         if allow_redirects is None:
             allow_redirects = True
 
+        if cache is not None and method == 'GET' and not stream:
+            cache_key = self._get_cache_key(url, params, headers)
+            cached = cache.get_item(cache_key)
+            if cached:
+                validators = cached
+        else:
+            cache_key = cached = None
+        if validators:
+            headers = self._conditional_headers(headers, validators)
+
         response = None
+        limiter = self._get_limiter(url)
+        limiter.acquire()
+        start_time = time()
         try:
             response = self._session.request(method, url,
                                              params=params,
@@ -97,9 +274,21 @@ class BaseRequestsClass(object):
                                              verify=verify,
                                              cert=cert,
                                              json=json)
-            if not getattr(response, 'status_code', None):
+            status_code = getattr(response, 'status_code', None)
+            limiter.release(
+                latency=time() - start_time,
+                throttled=status_code in self._throttled_status_codes,
+            )
+            limiter = None
+            if not status_code:
                 raise self._default_exc[0](response=response)
 
+            if cache_key:
+                response = self._cache_response(response,
+                                                cache,
+                                                cache_key,
+                                                cached)
+
             if response_hook:
                 if response_hook_kwargs is None:
                     response_hook_kwargs = {}
@@ -109,6 +298,10 @@ class BaseRequestsClass(object):
                 response.raise_for_status()
 
         except self._default_exc as exc:
+            if limiter:
+                limiter.release(throttled=isinstance(exc, (ConnectionError,
+                                                           Timeout)))
+                limiter = None
             exc_response = exc.response or response
             response_text = exc_response and exc_response.text
             stack_trace = format_stack()
@@ -176,4 +369,28 @@ class BaseRequestsClass(object):
                     raise raise_exc
                 raise exc
 
+        finally:
+            if limiter:
+                limiter.release()
+
+        return response
+
+    def _cache_response(self, response, cache, cache_key, cached):
+        status_code = response.status_code
+        if status_code == 304 and cached:
+            log_debug('BaseRequestsClass.request - Not modified: |{0}|'
+                      .format(response.url))
+            response.status_code = cached['status_code']
+            response.encoding = 'utf-8'
+            response._content = cached['content'].encode('utf-8')
+            return response
+        if status_code != 200:
+            return response
+        validators = self.get_validators(response)
+        if validators:
+            validators['status_code'] = status_code
+            validators['content'] = response.text
+            cache.set_item(cache_key, validators)
+        elif cached:
+            cache.remove(cache_key)
         return response
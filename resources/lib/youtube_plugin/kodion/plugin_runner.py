@@ -14,7 +14,9 @@ from copy import deepcopy
 from platform import python_version
 
 from .context import XbmcContext
+from .network import BaseRequestsClass
 from .plugin import XbmcPlugin
+from .sql_store import Storage
 from ..youtube import Provider
 
 
@@ -60,7 +62,17 @@ def run(context=_context,
                                path=context.get_path(),
                                params=params))
 
-    plugin.run(provider, context, focused=(current_uri == new_uri))
+    try:
+        plugin.run(provider, context, focused=(current_uri == new_uri))
+    finally:
+        # The interpreter may be reused for subsequent invocations, so release
+        # database connections and queue maintenance at the end of each run
+        # rather than only when the process exits
+        context.release_storage()
 
     if profiler:
         profiler.print_stats()
+        context.log_debug('Storage stats: {0}'.format(Storage.get_stats()))
+        context.log_debug('Request pool stats: {0}'.format(
+            BaseRequestsClass.get_pool_stats()
+        ))
@@ -56,9 +56,13 @@ def run():
     video_id = None
     container = monitor.is_plugin_container()
     while not monitor.abortRequested():
+        idle = get_infobool('System.IdleTime(10)')
+        if idle:
+            monitor.run_maintenance()
+
         if not monitor.httpd:
             waited = 0
-        elif get_infobool('System.IdleTime(10)'):
+        elif idle:
             if waited >= 30:
                 waited = 0
                 monitor.shutdown_httpd(sleep=True)
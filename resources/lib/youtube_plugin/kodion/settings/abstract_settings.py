@@ -328,6 +328,9 @@ class AbstractSettings(object):
     def get_play_count_min_percent(self):
         return self.get_int(settings.PLAY_COUNT_MIN_PERCENT, 0)
 
+    def get_playlist_prefetch_percent(self):
+        return self.get_int(settings.PLAYLIST_PREFETCH_PERCENT, 80)
+
     def use_local_history(self):
         return self.get_bool(settings.USE_LOCAL_HISTORY, False)
 
@@ -13,6 +13,7 @@ from .feed_history import FeedHistory
 from .function_cache import FunctionCache
 from .playback_history import PlaybackHistory
 from .search_history import SearchHistory
+from .storage import Storage
 from .watch_later_list import WatchLaterList
 
 
@@ -23,5 +24,6 @@ __all__ = (
     'FunctionCache',
     'PlaybackHistory',
     'SearchHistory',
+    'Storage',
     'WatchLaterList',
 )
@@ -19,6 +19,9 @@ class DataCache(Storage):
     _table_updated = False
     _sql = {}
 
+    _codec = Storage.CODEC_JSON_ZLIB
+    _memory_cache_size = 8 * 1024 * 1024
+
     def __init__(self, filepath, max_file_size_mb=5):
         max_file_size_kb = max_file_size_mb * 1024
         super(DataCache, self).__init__(filepath,
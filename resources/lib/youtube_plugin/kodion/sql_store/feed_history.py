@@ -18,6 +18,8 @@ class FeedHistory(Storage):
     _table_updated = False
     _sql = {}
 
+    _codec = Storage.CODEC_JSON_ZLIB
+
     def __init__(self, filepath):
         super(FeedHistory, self).__init__(filepath)
 
@@ -13,8 +13,12 @@ from __future__ import absolute_import, division, unicode_literals
 from functools import partial
 from hashlib import md5
 from itertools import chain
+from threading import BoundedSemaphore, Lock, Thread
+from time import time
 
 from .storage import Storage
+from ..logger import log_debug, log_error
+from ..utils.single_flight import SingleFlight
 
 
 class FunctionCache(Storage):
@@ -28,6 +32,12 @@ class FunctionCache(Storage):
     SCOPE_BUILTINS = 1
     SCOPE_ALL = 2
 
+    _revalidate_limit = BoundedSemaphore(2)
+    _revalidate_lock = Lock()
+    _revalidating = set()
+    _revalidate_threads = set()
+    _single_flight = SingleFlight()
+
     def __init__(self, filepath, max_file_size_mb=5):
         max_file_size_kb = max_file_size_mb * 1024
         super(FunctionCache, self).__init__(filepath,
@@ -111,6 +121,8 @@ class FunctionCache(Storage):
         :keyword _refresh: (bool) updates cache with new result, default False
         :keyword _retry_value: (Any) re-evaluate func if cached value is equal
                                _retry_value, default None
+        :keyword _stale_ok: (bool) return expired cached result immediately and
+                            update cache in a background thread, default False
         :return:
         """
         scope = kwargs.pop('_scope', self.SCOPE_ALL)
@@ -118,6 +130,7 @@ class FunctionCache(Storage):
         oneshot = kwargs.pop('_oneshot', False)
         refresh = kwargs.pop('_refresh', False)
         retry_value = kwargs.pop('_retry_value', None)
+        stale_ok = kwargs.pop('_stale_ok', False)
         partial_func = partial(func, *args, **kwargs)
 
         # if caching is disabled call the function
@@ -125,9 +138,23 @@ class FunctionCache(Storage):
             return partial_func()
 
         cache_id = self._create_id_from_func(partial_func, scope)
-        data = retry_value if refresh else self._get(cache_id, seconds=seconds)
+        if refresh:
+            data = retry_value
+        elif stale_ok and seconds:
+            cached = self._get(cache_id, as_dict=True)
+            if not cached:
+                data = retry_value
+            elif cached['age'] <= seconds:
+                data = cached['value']
+            elif (cached['value'] != retry_value
+                  and self._revalidate(cache_id, partial_func, ignore_value)):
+                return cached['value']
+            else:
+                data = retry_value
+        else:
+            data = self._get(cache_id, seconds=seconds)
         if data == retry_value:
-            data = partial_func()
+            data = self._single_flight.run(cache_id, partial_func)
         if data != ignore_value:
             self._set(cache_id, data)
         elif oneshot:
@@ -135,6 +162,63 @@ class FunctionCache(Storage):
 
         return data
 
+    def _revalidate(self, cache_id, partial_func, ignore_value):
+        """
+        Updates the cached result of partial_func in a background thread.
+        Returns False if the number of concurrent updates is already at the
+        limit, in which case the caller should update the cache itself.
+        """
+        with self._revalidate_lock:
+            if cache_id in self._revalidating:
+                return True
+            if not self._revalidate_limit.acquire(False):
+                return False
+            self._revalidating.add(cache_id)
+
+        def _update():
+            try:
+                data = self._single_flight.run(cache_id, partial_func)
+                if data != ignore_value:
+                    self._set(cache_id, data)
+            except Exception as exc:
+                log_error('FunctionCache._revalidate - {exc}'.format(exc=exc))
+            finally:
+                with self._revalidate_lock:
+                    self._revalidating.discard(cache_id)
+                    self._revalidate_threads.discard(thread)
+                self._revalidate_limit.release()
+
+        log_debug('FunctionCache._revalidate - |{0}|'.format(cache_id))
+        # Non-daemon thread so that interpreter shutdown, and Storage teardown,
+        # waits for the update to be written
+        thread = Thread(target=_update)
+        with self._revalidate_lock:
+            self._revalidate_threads.add(thread)
+        thread.start()
+        return True
+
+    @classmethod
+    def wait_for_revalidation(cls, timeout=3):
+        """
+        Waits up to timeout seconds for background updates of cached results
+        to complete, so that they are written before connections are closed.
+        Returns False if updates are still pending after the timeout.
+        """
+        with cls._revalidate_lock:
+            threads = list(cls._revalidate_threads)
+        if not threads:
+            return True
+        end_time = time() + timeout
+        for thread in threads:
+            thread.join(max(end_time - time(), 0))
+        with cls._revalidate_lock:
+            pending = len(cls._revalidate_threads)
+        if pending:
+            log_debug('FunctionCache.wait_for_revalidation'
+                      ' - {0} update(s) pending'.format(pending))
+            return False
+        return True
+
     def _optimize_item_count(self, limit=-1, defer=False):
         # override method Storage._optimize_item_count
         # for function cache do not optimize by item count, use database size.
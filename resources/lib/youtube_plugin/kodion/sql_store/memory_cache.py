@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+
+    Copyright (C) 2024-present plugin.video.youtube
+
+    SPDX-License-Identifier: GPL-2.0-only
+    See LICENSES/GPL-2.0-only for more information.
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+from collections import OrderedDict
+from threading import Lock
+
+from ..compatibility import string_type
+from ..utils.datetime_parser import since_epoch
+
+
+class MemoryCache(object):
+    """
+    In-memory LRU cache of encoded database rows, bounded by size in bytes.
+    Values of simple types are also retained in decoded form.
+    """
+
+    _SIMPLE_TYPES = (string_type, bytes, int, float, bool, type(None))
+
+    def __init__(self, max_size):
+        self._items = OrderedDict()
+        self._lock = Lock()
+        self._max_size = max_size
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, seconds=None):
+        """
+        Returns a row tuple of (key, timestamp, blob, size, value) for the
+        given key if it is cached and not older than seconds, otherwise None.
+        value will be Ellipsis if the decoded value has not been retained
+        """
+        cut_off = since_epoch() - seconds if seconds else 0
+        with self._lock:
+            entry = self._items.pop(key, None)
+            if entry:
+                self._items[key] = entry
+                if seconds:
+                    entry[5] = seconds
+                if not cut_off or entry[1] >= cut_off:
+                    self.hits += 1
+                    value = entry[4]
+                    if isinstance(value, dict):
+                        value = dict(value)
+                    return entry[0], entry[1], entry[2], entry[3], value
+            self.misses += 1
+        return None
+
+    def get_many(self, keys, seconds=None):
+        """
+        Returns a tuple of a list of cached row tuples of
+        (key, timestamp, blob, size), and a list of keys not found in the cache
+        """
+        cut_off = since_epoch() - seconds if seconds else 0
+        found = []
+        missing = []
+        with self._lock:
+            items = self._items
+            for key in keys:
+                entry = items.pop(key, None)
+                if entry:
+                    items[key] = entry
+                    if seconds:
+                        entry[5] = seconds
+                    if not cut_off or entry[1] >= cut_off:
+                        found.append((entry[0], entry[1], entry[2], entry[3]))
+                        continue
+                missing.append(key)
+            self.hits += len(found)
+            self.misses += len(missing)
+        return found, missing
+
+    def set(self, row, value=Ellipsis):
+        key, timestamp, blob, size = row[:4]
+        if value is not Ellipsis:
+            parts = value.values() if isinstance(value, dict) else (value,)
+            if all(isinstance(part, self._SIMPLE_TYPES) for part in parts):
+                if isinstance(value, dict):
+                    value = dict(value)
+                size += sum(len(part)
+                            if isinstance(part, (string_type, bytes)) else
+                            8
+                            for part in parts)
+            else:
+                value = Ellipsis
+
+        if size > self._max_size // 4:
+            self.remove(key)
+            return
+
+        with self._lock:
+            items = self._items
+            entry = items.pop(key, None)
+            if entry:
+                self._size -= entry[3]
+            ttl = entry[5] if entry else None
+            items[key] = [key, timestamp, blob, size, value, ttl]
+            self._size += size
+            if self._size > self._max_size:
+                self._evict()
+
+    def _evict(self):
+        items = self._items
+        now = since_epoch()
+        # Evict entries that have expired for the most recent lookup first
+        for key, entry in list(items.items()):
+            ttl = entry[5]
+            if ttl and entry[1] + ttl < now:
+                del items[key]
+                self._size -= entry[3]
+        # Then evict least recently used entries
+        while self._size > self._max_size and items:
+            _, entry = items.popitem(last=False)
+            self._size -= entry[3]
+
+    def remove(self, key):
+        with self._lock:
+            entry = self._items.pop(key, None)
+            if entry:
+                self._size -= entry[3]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._size = 0
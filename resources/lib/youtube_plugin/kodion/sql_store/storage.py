@@ -10,18 +10,68 @@
 
 from __future__ import absolute_import, division, unicode_literals
 
+import json
 import os
 import pickle
 import sqlite3
 import time
+import zlib
 from threading import Lock
 from traceback import format_stack
 
-from ..logger import log_error
+from .memory_cache import MemoryCache
+from ..compatibility import MutableMapping
+from ..logger import log_debug, log_error
 from ..utils.datetime_parser import fromtimestamp, since_epoch
 from ..utils.methods import make_dirs
 
 
+class LazyDecodeMapping(MutableMapping):
+    """
+    Mapping of keys to stored values, retaining the order of the retrieved
+    rows, where each value is only decoded when it is first accessed
+    """
+
+    __slots__ = (
+        '_decode',
+        '_items',
+        '_pending',
+    )
+
+    def __init__(self, rows, decode):
+        self._decode = decode
+        self._items = {row[0]: row for row in rows}
+        self._pending = set(self._items)
+
+    def __getitem__(self, key):
+        value = self._items[key]
+        if key in self._pending:
+            value = self._decode(value)
+            self._items[key] = value
+            self._pending.discard(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self._items[key] = value
+        self._pending.discard(key)
+
+    def __delitem__(self, key):
+        del self._items[key]
+        self._pending.discard(key)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __repr__(self):
+        return '{0}({1!r})'.format(self.__class__.__name__, list(self._items))
+
+
 class Storage(object):
     ONE_MINUTE = 60
     ONE_HOUR = 60 * ONE_MINUTE
@@ -29,7 +79,31 @@ class Storage(object):
     ONE_WEEK = 7 * ONE_DAY
     ONE_MONTH = 4 * ONE_WEEK
 
+    # Values are stored with a leading header byte identifying the codec used.
+    # Pickled values are stored as-is, as the pickle protocol opcode (0x80)
+    # is used as the header, allowing rows written prior to the introduction
+    # of the codec header to be read without migration.
+    # The JSON codecs are only used for values that round-trip through JSON
+    # unchanged, other values are pickled.
+    CODEC_PICKLE = 'pickle'
+    CODEC_JSON = 'json'
+    CODEC_JSON_ZLIB = 'json_zlib'
+
+    _HEADER_JSON = b'\x01'
+    _HEADER_JSON_ZLIB = b'\x02'
+
+    _codec = CODEC_PICKLE
+    _compress_threshold = 1024
+    _compress_level = 1
+
+    # Size in bytes of in-memory cache of stored rows, 0 to disable
+    _memory_cache_size = 0
+
     _base = None
+    _window_functions = sqlite3.sqlite_version_info >= (3, 25, 0)
+    _connections = {}
+    _connections_lock = Lock()
+    _maintenance_queue = set()
     _table_name = 'storage_v2'
     _table_created = False
     _table_updated = False
@@ -48,6 +122,11 @@ class Storage(object):
             '  size INTEGER'
             ' );'
         ),
+        'create_timestamp_index': (
+            'CREATE INDEX'
+            ' IF NOT EXISTS {table}_timestamp'
+            ' ON {table} (timestamp);'
+        ),
         'drop_old_table': (
             'DELETE'
             ' FROM sqlite_master'
@@ -78,6 +157,22 @@ class Storage(object):
             ' ORDER BY {order_col} DESC'
             ' LIMIT {{0}};'
         ),
+        'get_by_key_prefix': (
+            'SELECT *'
+            ' FROM {table}'
+            ' WHERE key >= ?'
+            ' AND key < ?'
+            ' ORDER BY {order_col}'
+            ' LIMIT {{0}};'
+        ),
+        'get_by_key_prefix_desc': (
+            'SELECT *'
+            ' FROM {table}'
+            ' WHERE key >= ?'
+            ' AND key < ?'
+            ' ORDER BY {order_col} DESC'
+            ' LIMIT {{0}};'
+        ),
         'get_many': (
             'SELECT *'
             ' FROM {table}'
@@ -98,6 +193,10 @@ class Storage(object):
             ' and name IS NOT "{table}"'
             ');'
         ),
+        'get_total_size': (
+            'SELECT SUM(size)'
+            ' FROM {table};'
+        ),
         'is_empty': (
             'SELECT EXISTS ('
             ' SELECT 1'
@@ -116,6 +215,23 @@ class Storage(object):
             ' );'
         ),
         'prune_by_size': (
+            'DELETE'
+            ' FROM {table}'
+            ' WHERE rowid IN ('
+            '  SELECT rowid'
+            '  FROM ('
+            '   SELECT rowid,'
+            '    SUM(size) OVER ('
+            '     ORDER BY timestamp'
+            '     ROWS UNBOUNDED PRECEDING'
+            '    ) AS size_total'
+            '   FROM {table}'
+            '  )'
+            '  WHERE size_total <= {{0}}'
+            ' );'
+        ),
+        # Fallback for SQLite < v3.25.0 that does not support window functions
+        'prune_by_size_legacy': (
             'DELETE'
             ' FROM {table}'
             ' WHERE rowid IN ('
@@ -159,9 +275,8 @@ class Storage(object):
                  migrate=False):
         self.uuid = filepath[1]
         self._filepath = os.path.join(*filepath)
-        self._db = None
-        self._cursor = None
-        self._lock = Lock()
+        self._connection = self._get_connection(self._filepath,
+                                                self._memory_cache_size)
         self._max_item_count = -1 if migrate else max_item_count
         self._max_file_size_kb = -1 if migrate else max_file_size_kb
 
@@ -188,17 +303,82 @@ class Storage(object):
     def set_max_file_size_kb(self, max_file_size_kb):
         self._max_file_size_kb = max_file_size_kb
 
+    @classmethod
+    def _get_connection(cls, filepath, memory_cache_size=0):
+        """
+        Connections, and the optional in-memory cache of stored rows, are
+        shared by all instances using the same database file. Connections are
+        closed by close_all at the end of each plugin invocation and reopened
+        as required
+        """
+        with cls._connections_lock:
+            connection = cls._connections.get(filepath)
+            if not connection:
+                connection = {
+                    'db': None,
+                    'cursor': None,
+                    'lock': Lock(),
+                    'memory': None,
+                    'data_version': None,
+                    'opens': 0,
+                    'queries': 0,
+                }
+                cls._connections[filepath] = connection
+            if memory_cache_size and not connection['memory']:
+                connection['memory'] = MemoryCache(memory_cache_size)
+        return connection
+
+    @classmethod
+    def get_stats(cls):
+        stats = {}
+        with cls._connections_lock:
+            for filepath, connection in cls._connections.items():
+                memory = connection['memory']
+                stats[filepath] = {
+                    'opens': connection['opens'],
+                    'queries': connection['queries'],
+                    'memory_hits': memory.hits if memory else 0,
+                    'memory_misses': memory.misses if memory else 0,
+                }
+        return stats
+
+    @classmethod
+    def close_all(cls):
+        with cls._connections_lock:
+            connections = list(cls._connections.items())
+        for filepath, connection in connections:
+            with connection['lock']:
+                if not connection['db']:
+                    continue
+                cls._close(connection)
+            memory = connection['memory']
+            log_debug('SQLStorage.close_all - |{filepath}|'
+                      ' opens: {opens}, queries: {queries},'
+                      ' memory hits: {hits}, memory misses: {misses}'
+                      .format(filepath=filepath,
+                              opens=connection['opens'],
+                              queries=connection['queries'],
+                              hits=memory.hits if memory else 0,
+                              misses=memory.misses if memory else 0))
+
     def __enter__(self):
-        self._lock.acquire()
-        if not self._db or not self._cursor:
+        connection = self._connection
+        connection['lock'].acquire()
+        if (not connection['db'] or not connection['cursor']
+                or not os.path.exists(self._filepath)):
             self._open()
-        return self._db, self._cursor
+        elif connection['memory']:
+            self._check_data_version(connection)
+        return connection['db'], connection['cursor']
 
     def __exit__(self, exc_type=None, exc_val=None, exc_tb=None):
-        self._close()
-        self._lock.release()
+        self._connection['lock'].release()
 
     def _open(self):
+        connection = self._connection
+        if connection['db']:
+            self._close(connection)
+
         if not os.path.exists(self._filepath):
             make_dirs(os.path.dirname(self._filepath))
             self._base._table_created = False
@@ -235,13 +415,15 @@ class Storage(object):
             'PRAGMA page_size = 4096;',
             'PRAGMA cache_size = 1000;',
             'PRAGMA journal_mode = WAL;',
+            'PRAGMA auto_vacuum = INCREMENTAL;',
         ]
         statements = []
 
         if not self._table_created:
-            statements.append(
-                self._sql['create_table']
-            )
+            statements.extend((
+                self._sql['create_table'],
+                self._sql['create_timestamp_index'],
+            ))
 
         if not self._table_updated:
             for result in self._execute(cursor, self._sql['has_old_table']):
@@ -261,22 +443,54 @@ class Storage(object):
 
         self._base._table_created = True
         self._base._table_updated = True
-        self._db = db
-        self._cursor = cursor
-
-    def _close(self):
-        if self._cursor:
-            self._execute(self._cursor, 'PRAGMA optimize')
-            self._cursor.close()
-            self._cursor = None
-        if self._db:
-            # Not needed if using self._db as a context manager
-            # self._db.commit()
-            self._db.close()
-            self._db = None
+        connection['db'] = db
+        connection['cursor'] = cursor
+        connection['opens'] += 1
+        # Changes made while the connection was closed, or a recreated
+        # database, can not be detected so the in-memory cache is dropped
+        connection['data_version'] = None
+        if connection['memory']:
+            self._check_data_version(connection)
+        return True
+
+    def _check_data_version(self, connection):
+        """
+        Clears the in-memory cache if the database has been modified by a
+        connection in another process since the cache was last validated.
+        Changes made using this connection do not change the data_version.
+        """
+        cursor = connection['cursor']
+        if not cursor:
+            return
+        data_version = None
+        for result in self._execute(cursor, 'PRAGMA data_version;'):
+            data_version = result[0]
+            break
+        if data_version is None or data_version != connection['data_version']:
+            memory = connection['memory']
+            if memory:
+                memory.clear()
+            connection['data_version'] = data_version
 
     @staticmethod
-    def _execute(cursor, query, values=None, many=False, script=False):
+    def _close(connection):
+        cursor = connection['cursor']
+        if cursor:
+            try:
+                cursor.execute('PRAGMA optimize')
+            except (sqlite3.Error, sqlite3.OperationalError) as exc:
+                log_error('SQLStorage._close - {exc}'.format(exc=exc))
+            cursor.close()
+            connection['cursor'] = None
+        db = connection['db']
+        if db:
+            # Not needed if using db as a context manager
+            # db.commit()
+            db.close()
+            connection['db'] = None
+
+    def _execute(self, cursor, query, values=None, many=False, script=False):
+        self._connection['queries'] += 1
         if values is None:
             values = ()
         """
@@ -305,22 +519,56 @@ class Storage(object):
         if self._max_file_size_kb <= 0:
             return False
 
-        try:
-            file_size_kb = (os.path.getsize(self._filepath) // 1024)
-            if file_size_kb <= self._max_file_size_kb:
-                return False
-        except OSError:
+        used_size = self.get_used_size()
+        if used_size // 1024 <= self._max_file_size_kb:
             return False
 
-        prune_size = 1024 * int(file_size_kb - self._max_file_size_kb / 2)
-        query = self._sql['prune_by_size'].format(prune_size)
+        # Rows are pruned by their stored size, which excludes the page and
+        # index overhead included in the used size, so the amount to prune is
+        # scaled to reduce the used size to half of the limit
+        with self as (db, cursor):
+            for result in self._execute(cursor, self._sql['get_total_size']):
+                total_size = result[0] or 0
+                break
+            else:
+                return False
+        target_size = 1024 * self._max_file_size_kb / 2
+        prune_size = int(total_size * (1 - target_size / used_size))
+        if self._window_functions:
+            query = self._sql['prune_by_size']
+        else:
+            query = self._sql['prune_by_size_legacy']
+        query = query.format(prune_size)
         if defer:
             return query
         with self as (db, cursor), db:
             self._execute(cursor, query)
-            self._execute(cursor, 'VACUUM')
+            self._execute(cursor, 'PRAGMA incremental_vacuum;', script=True)
+        self._checkpoint()
         return True
 
+    def get_used_size(self):
+        """
+        Returns the size in bytes of the pages in use by the database. The file
+        size is not used, as in WAL mode pages freed by incremental_vacuum are
+        only released from the file after the WAL has been checkpointed.
+        """
+        sizes = []
+        with self as (db, cursor):
+            for pragma in ('page_count', 'freelist_count', 'page_size'):
+                for result in self._execute(cursor,
+                                            'PRAGMA {0};'.format(pragma)):
+                    sizes.append(result[0])
+                    break
+                else:
+                    return 0
+        page_count, freelist_count, page_size = sizes
+        return (page_count - freelist_count) * page_size
+
+    def _checkpoint(self):
+        with self as (db, cursor):
+            self._execute(cursor, 'PRAGMA wal_checkpoint(TRUNCATE);')
+
     def _optimize_item_count(self, limit=-1, defer=False):
         # do nothing - optimize only if max item limit has been set
         if self._max_item_count < 0:
@@ -339,46 +587,83 @@ class Storage(object):
             return query
         with self as (db, cursor), db:
             self._execute(cursor, query)
-            self._execute(cursor, 'VACUUM')
+            self._execute(cursor, 'PRAGMA incremental_vacuum;', script=True)
+        self._checkpoint()
+        return True
+
+    def _queue_maintenance(self):
+        """
+        Pruning is not done when writing to the database. Instead the database
+        is queued for maintenance that will be done by the service when idle
+        """
+        if self._max_item_count < 0:
+            if self._max_file_size_kb <= 0:
+                return False
+            # The file size can include free pages, so is only used as a
+            # cheap upper bound. The size of the pages in use is checked
+            # when maintenance is done
+            try:
+                file_size_kb = (os.path.getsize(self._filepath) // 1024)
+                if file_size_kb <= self._max_file_size_kb:
+                    return False
+            except OSError:
+                return False
+
+        with self._connections_lock:
+            Storage._maintenance_queue.add(os.path.basename(self._filepath))
         return True
 
+    @classmethod
+    def pop_maintenance_queue(cls):
+        with cls._connections_lock:
+            queue = Storage._maintenance_queue
+            Storage._maintenance_queue = set()
+        return queue
+
+    def maintenance(self):
+        pruned = self._optimize_item_count()
+        pruned = self._optimize_file_size() or pruned
+        return pruned
+
     def _set(self, item_id, item, timestamp=None):
         values = self._encode(item_id, item, timestamp)
-        optimize_query = self._optimize_item_count(1, defer=True)
         with self as (db, cursor), db:
-            if optimize_query:
-                self._execute(cursor, 'BEGIN')
-                self._execute(cursor, optimize_query)
             self._execute(cursor, self._sql['set'], values=values)
+        memory = self._connection['memory']
+        if memory:
+            memory.set(values, item)
+        self._queue_maintenance()
 
     def _set_many(self, items, flatten=False):
         now = since_epoch()
         num_items = len(items)
 
+        rows = [self._encode(*item, timestamp=now) for item in items.items()]
         if flatten:
-            values = [enc_part
-                      for item in items.items()
-                      for enc_part in self._encode(*item, timestamp=now)]
+            values = [enc_part for row in rows for enc_part in row]
             query = self._sql['set_flat'].format(
                 '(?,?,?,?),' * (num_items - 1) + '(?,?,?,?)'
             )
         else:
-            values = [self._encode(*item, timestamp=now)
-                      for item in items.items()]
+            values = rows
             query = self._sql['set']
 
-        optimize_query = self._optimize_item_count(num_items, defer=True)
         with self as (db, cursor), db:
             self._execute(cursor, 'BEGIN')
-            if optimize_query:
-                self._execute(cursor, optimize_query)
             self._execute(cursor, query, many=(not flatten), values=values)
-        self._optimize_file_size()
+        memory = self._connection['memory']
+        if memory:
+            for row in rows:
+                memory.set(row)
+        self._queue_maintenance()
 
     def clear(self, defer=False):
         query = self._sql['clear']
         if defer:
             return query
+        memory = self._connection['memory']
+        if memory:
+            memory.clear()
         with self as (db, cursor), db:
             self._execute(cursor, query)
             self._execute(cursor, 'VACUUM')
@@ -394,44 +679,101 @@ class Storage(object):
                 is_empty = True
         return is_empty
 
-    @staticmethod
-    def _decode(obj, process=None, item=None):
-        decoded_obj = pickle.loads(obj)
+    @classmethod
+    def _decode(cls, obj, process=None, item=None):
+        header = obj[:1]
+        if header == cls._HEADER_JSON_ZLIB:
+            decoded_obj = json.loads(
+                zlib.decompress(obj[1:]).decode('utf-8')
+            )
+        elif header == cls._HEADER_JSON:
+            decoded_obj = json.loads(bytes(obj[1:]).decode('utf-8'))
+        else:
+            decoded_obj = pickle.loads(obj)
         if process:
             return process(decoded_obj, item)
         return decoded_obj
 
-    @staticmethod
-    def _encode(key, obj, timestamp=None):
+    def _encode(self, key, obj, timestamp=None):
         timestamp = timestamp or since_epoch()
-        blob = sqlite3.Binary(pickle.dumps(
-            obj, protocol=pickle.HIGHEST_PROTOCOL
-        ))
+        codec = self._codec
+        blob = None
+        if codec != self.CODEC_PICKLE:
+            try:
+                blob = json.dumps(obj, separators=(',', ':'))
+                # JSON converts tuples to lists and non-str keys to str, so
+                # values that do not round-trip unchanged are pickled instead
+                if json.loads(blob) != obj:
+                    blob = None
+            except (TypeError, ValueError):
+                # Fallback to pickle for values not serialisable as JSON
+                blob = None
+            if blob is not None:
+                blob = blob.encode('utf-8')
+                if (codec == self.CODEC_JSON_ZLIB
+                        and len(blob) > self._compress_threshold):
+                    blob = self._HEADER_JSON_ZLIB + zlib.compress(
+                        blob, self._compress_level
+                    )
+                else:
+                    blob = self._HEADER_JSON + blob
+        if blob is None:
+            blob = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+        blob = sqlite3.Binary(blob)
         size = getattr(blob, 'nbytes', None)
         if not size:
             size = int(memoryview(blob).itemsize) * len(blob)
         return str(key), timestamp, blob, size
 
     def _get(self, item_id, process=None, seconds=None, as_dict=False):
-        with self as (db, cursor), db:
-            result = self._execute(cursor, self._sql['get'], [str(item_id)])
-            item = result.fetchone() if result else None
-            if not item:
+        key = str(item_id)
+        memory = self._connection['memory']
+        if memory:
+            # Entering the context validates the in-memory cache
+            with self:
+                item = memory.get(key, seconds)
+        else:
+            item = None
+        if item:
+            value = item[4]
+            if value is Ellipsis:
+                value = self._decode(item[2])
+        else:
+            with self as (db, cursor), db:
+                result = self._execute(cursor, self._sql['get'], [key])
+                item = result.fetchone() if result else None
+                if not item:
+                    return None
+            cut_off = since_epoch() - seconds if seconds else 0
+            if cut_off and item[1] < cut_off:
                 return None
-        cut_off = since_epoch() - seconds if seconds else 0
-        if not cut_off or item[1] >= cut_off:
-            if as_dict:
-                return {
-                    'item_id': item_id,
-                    'age': since_epoch() - item[1],
-                    'value': self._decode(item[2], process, item),
-                }
-            return self._decode(item[2], process, item)
-        return None
+            value = self._decode(item[2])
+            if memory:
+                memory.set(item, value)
+        if process:
+            value = process(value, item)
+        if as_dict:
+            return {
+                'item_id': item_id,
+                'age': since_epoch() - item[1],
+                'value': value,
+            }
+        return value
+
+    @staticmethod
+    def _get_key_prefix(item_ids):
+        if len(item_ids) != 1:
+            return None
+        pattern = item_ids[0]
+        prefix = pattern[:-1]
+        if not prefix or pattern[-1] != '%' or '%' in prefix:
+            return None
+        return prefix
 
     def _get_by_ids(self, item_ids=None, oldest_first=True, limit=-1,
                     wildcard=False, seconds=None, process=None,
                     as_dict=False, values_only=True):
+        memory = cached = query = None
         if not item_ids:
             if oldest_first:
                 query = self._sql['get_many']
@@ -439,55 +781,90 @@ class Storage(object):
                 query = self._sql['get_many_desc']
             query = query.format(limit)
         elif wildcard:
-            if oldest_first:
+            prefix = self._get_key_prefix(item_ids)
+            if prefix:
+                # Prefix matches are done as a range scan of the primary key
+                # index, as LIKE can not use the index with the default case
+                # insensitive LIKE behaviour and BINARY key collation
+                if oldest_first:
+                    query = self._sql['get_by_key_prefix']
+                else:
+                    query = self._sql['get_by_key_prefix_desc']
+                item_ids = (
+                    prefix,
+                    prefix[:-1] + chr(ord(prefix[-1]) + 1),
+                )
+            elif oldest_first:
                 query = self._sql['get_by_key_like']
             else:
                 query = self._sql['get_by_key_like_desc']
             query = query.format(limit)
         else:
+            memory = self._connection['memory']
+            if memory:
+                # Entering the context validates the in-memory cache
+                with self:
+                    cached, item_ids = memory.get_many(
+                        [str(item_id) for item_id in item_ids], seconds
+                    )
             num_ids = len(item_ids)
-            query = self._sql['get_by_key'].format('?,' * (num_ids - 1) + '?')
+            if num_ids:
+                query = self._sql['get_by_key'].format(
+                    '?,' * (num_ids - 1) + '?'
+                )
             item_ids = tuple(item_ids)
 
         epoch = since_epoch()
         cut_off = epoch - seconds if seconds else 0
-        with self as (db, cursor), db:
-            result = self._execute(cursor, query, item_ids)
-            if as_dict:
-                if values_only:
-                    result = {
-                        item[0]: self._decode(item[2], process, item)
-                        for item in result if not cut_off or item[1] >= cut_off
-                    }
-                else:
-                    result = {
-                        item[0]: {
-                            'age': epoch - item[1],
-                            'value': self._decode(item[2], process, item),
-                        }
-                        for item in result if not cut_off or item[1] >= cut_off
-                    }
-            elif values_only:
-                result = [
-                    self._decode(item[2], process, item)
-                    for item in result if not cut_off or item[1] >= cut_off
-                ]
+        if query:
+            with self as (db, cursor), db:
+                result = self._execute(cursor, query, item_ids)
+                result = [item for item in result
+                          if not cut_off or item[1] >= cut_off]
+            if memory:
+                for item in result:
+                    memory.set(item)
+        else:
+            result = []
+        if cached:
+            result = cached + result
+
+        if as_dict:
+            if values_only:
+                def _decode(item, _decode=self._decode):
+                    return _decode(item[2], process, item)
             else:
-                result = [
-                    (item[0],
-                     fromtimestamp(item[1]),
-                     self._decode(item[2], process, item))
-                    for item in result if not cut_off or item[1] >= cut_off
-                ]
+                def _decode(item, _decode=self._decode):
+                    return {
+                        'age': epoch - item[1],
+                        'value': _decode(item[2], process, item),
+                    }
+            result = LazyDecodeMapping(result, _decode)
+        elif values_only:
+            result = [self._decode(item[2], process, item) for item in result]
+        else:
+            result = [
+                (item[0],
+                 fromtimestamp(item[1]),
+                 self._decode(item[2], process, item))
+                for item in result
+            ]
         return result
 
     def _remove(self, item_id):
+        memory = self._connection['memory']
+        if memory:
+            memory.remove(str(item_id))
         with self as (db, cursor), db:
             self._execute(cursor, self._sql['remove'], [item_id])
 
     def _remove_many(self, item_ids):
+        memory = self._connection['memory']
+        if memory:
+            for item_id in item_ids:
+                memory.remove(str(item_id))
         num_ids = len(item_ids)
         query = self._sql['remove_by_key'].format('?,' * (num_ids - 1) + '?')
         with self as (db, cursor), db:
             self._execute(cursor, query, tuple(item_ids))
-            self._execute(cursor, 'VACUUM')
+            self._execute(cursor, 'PRAGMA incremental_vacuum;', script=True)
@@ -11,6 +11,7 @@
 from __future__ import absolute_import, division, unicode_literals
 
 from . import datetime_parser
+from .executor import BoundedExecutor
 from .methods import (
     duration_to_seconds,
     find_video_id,
@@ -30,10 +31,13 @@ from .methods import (
     validate_ip_address,
     wait,
 )
+from .single_flight import SingleFlight
 from .system_version import current_system_version
 
 
 __all__ = (
+    'BoundedExecutor',
+    'SingleFlight',
     'current_system_version',
     'datetime_parser',
     'duration_to_seconds',
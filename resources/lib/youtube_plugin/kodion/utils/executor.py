@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+
+    Copyright (C) 2024-present plugin.video.youtube
+
+    SPDX-License-Identifier: GPL-2.0-only
+    See LICENSES/GPL-2.0-only for more information.
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+from collections import deque
+from threading import Condition, Event, Lock, Thread
+from time import time
+
+from ..compatibility import cpu_count, xbmc
+from ..logger import log_error
+
+
+class Task(object):
+    __slots__ = (
+        'func',
+        'args',
+        'kwargs',
+        'value',
+        'error',
+        'cancelled',
+        '_done',
+    )
+
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.value = None
+        self.error = None
+        self.cancelled = False
+        self._done = Event()
+
+    def run(self):
+        try:
+            self.value = self.func(*self.args, **self.kwargs)
+        except Exception as exc:
+            self.error = exc
+        finally:
+            self._done.set()
+
+    def cancel(self):
+        self.cancelled = True
+        self._done.set()
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """
+        Waits for the task to complete and returns the value returned by the
+        task function, or re-raises the exception raised by the function.
+        Returns None if the task was cancelled or the timeout expired.
+        """
+        self._done.wait(timeout)
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class BoundedExecutor(object):
+    """
+    Runs tasks from a work queue using a bounded number of worker threads.
+    Workers are started as required and exit once idle. Queued tasks are
+    cancelled if Kodi requests an abort.
+    """
+
+    _idle_timeout = 1
+    _abort_check_interval = 0.5
+
+    def __init__(self, max_workers=None):
+        if not max_workers:
+            try:
+                num_cores = cpu_count() or 1
+            except NotImplementedError:
+                num_cores = 1
+            max_workers = min(32, 2 * (num_cores + 4))
+        self._max_workers = max_workers
+
+        lock = Lock()
+        self._work = Condition(lock)
+        self._done = Condition(lock)
+        self._queue = deque()
+        self._num_workers = 0
+        self._num_idle = 0
+        self._pending = 0
+        self._cancelled = False
+        self._monitor = xbmc.Monitor()
+
+    def submit(self, func, *args, **kwargs):
+        task = Task(func, args, kwargs)
+        with self._work:
+            if self._cancelled:
+                task.cancel()
+                return task
+            self._queue.append(task)
+            self._pending += 1
+            if self._num_idle:
+                self._work.notify()
+            # Notified workers remain counted as idle until they take a task,
+            # so a new worker is started for any tasks in excess of those
+            # that the idle workers will take
+            if (len(self._queue) > self._num_idle
+                    and self._num_workers < self._max_workers):
+                self._num_workers += 1
+                thread = Thread(target=self._worker)
+                thread.daemon = True
+                thread.start()
+        return task
+
+    def map(self, func, iterable, raise_exc=False):
+        """
+        Calls func with each item of iterable, using the worker threads.
+        Returns a list of the results in the same order as iterable, with None
+        in place of the result of any call that failed or was cancelled.
+        If raise_exc is True, the first exception raised is re-raised instead.
+        """
+        tasks = [self.submit(func, item) for item in iterable]
+        self.wait()
+        results = []
+        for task in tasks:
+            if task.error is None:
+                results.append(task.value)
+                continue
+            if raise_exc:
+                raise task.error
+            log_error('BoundedExecutor.map - {func}: |{exc}|'.format(
+                func=getattr(func, '__name__', func), exc=task.error
+            ))
+            results.append(None)
+        return results
+
+    def wait(self, timeout=None):
+        """
+        Waits for all submitted tasks to complete.
+        Returns False if the timeout expired or the tasks were cancelled.
+        """
+        end_time = time() + timeout if timeout else None
+        with self._done:
+            while self._pending and not self._cancelled:
+                if self._monitor.abortRequested():
+                    self._cancel()
+                    break
+                self._done.wait(self._abort_check_interval)
+                if end_time and time() >= end_time:
+                    return False
+        return not self._cancelled
+
+    def cancel(self):
+        with self._work:
+            self._cancel()
+
+    def _cancel(self):
+        self._cancelled = True
+        queue = self._queue
+        self._pending -= len(queue)
+        while queue:
+            queue.popleft().cancel()
+        self._work.notify_all()
+        self._done.notify_all()
+
+    def _worker(self):
+        work = self._work
+        queue = self._queue
+        while 1:
+            with work:
+                if not queue and not self._cancelled:
+                    self._num_idle += 1
+                    work.wait(self._idle_timeout)
+                    self._num_idle -= 1
+                if not queue or self._cancelled:
+                    self._num_workers -= 1
+                    return
+                task = queue.popleft()
+
+            if self._monitor.abortRequested():
+                task.cancel()
+                with work:
+                    self._pending -= 1
+                    self._cancel()
+                continue
+
+            task.run()
+            with work:
+                self._pending -= 1
+                if not self._pending:
+                    self._done.notify_all()
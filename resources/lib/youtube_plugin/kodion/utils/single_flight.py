@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+
+    Copyright (C) 2024-present plugin.video.youtube
+
+    SPDX-License-Identifier: GPL-2.0-only
+    See LICENSES/GPL-2.0-only for more information.
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+from threading import Event, Lock
+
+
+class SingleFlight(object):
+    """
+    Coalesces concurrent calls that share the same key, so that only the first
+    caller runs the function and all other callers wait for, and share, its
+    result or exception.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._calls = {}
+
+    def run(self, key, func, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            if call:
+                leader = False
+            else:
+                leader = True
+                call = self._calls[key] = {
+                    'done': Event(),
+                    'result': None,
+                    'error': None,
+                }
+
+        if not leader:
+            call['done'].wait()
+        else:
+            try:
+                call['result'] = func(*args, **kwargs)
+            except Exception as exc:
+                call['error'] = exc
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call['done'].set()
+
+        if call['error'] is not None:
+            raise call['error']
+        return call['result']
+
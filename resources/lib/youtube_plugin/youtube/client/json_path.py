@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+
+    Copyright (C) 2024-present plugin.video.youtube
+
+    SPDX-License-Identifier: GPL-2.0-only
+    See LICENSES/GPL-2.0-only for more information.
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+
+_CONTAINERS = (dict, list, tuple)
+
+
+class JsonPath(object):
+    """
+    Compiled form of a json_traverse path, that can be called repeatedly
+    with different JSON data without re-interpreting the path.
+
+    A path is a sequence of steps, where each step is one of:
+        key or index: item is retrieved from the current result
+        tuple/list of alternatives: first key or index that exists, or first
+            sub-path, itself a tuple/list, that returns a truthy value
+        slice: remaining steps are applied to each truthy item in the slice
+            of the current result, and a list of the results is returned
+    """
+
+    __slots__ = (
+        '_steps',
+        '_slice',
+        '_remaining',
+        '_empty',
+    )
+
+    def __init__(self, path):
+        steps = []
+        self._slice = None
+        self._remaining = None
+        self._empty = not path
+
+        for idx, keys in enumerate(path):
+            if isinstance(keys, slice):
+                self._slice = keys
+                self._remaining = JsonPath(path[idx + 1:])
+                break
+            if isinstance(keys, (list, tuple)):
+                steps.append((None, tuple(
+                    JsonPath(key) if isinstance(key, (list, tuple)) else key
+                    for key in keys
+                )))
+            else:
+                steps.append((keys, None))
+        self._steps = tuple(steps)
+
+    def __call__(self, json_data, default=None):
+        if not json_data or self._empty:
+            return default
+
+        result = json_data
+        for key, alternatives in self._steps:
+            if not isinstance(result, _CONTAINERS):
+                return default
+
+            if alternatives is None:
+                try:
+                    result = result[key]
+                except (KeyError, IndexError):
+                    return default
+                continue
+
+            for key in alternatives:
+                if isinstance(key, JsonPath):
+                    new_result = key(result, default)
+                    if new_result:
+                        result = new_result
+                        break
+                    continue
+
+                try:
+                    result = result[key]
+                except (KeyError, IndexError):
+                    continue
+                break
+            else:
+                return default
+
+        if self._slice is not None:
+            if not isinstance(result, _CONTAINERS):
+                return default
+            remaining = self._remaining
+            return [
+                remaining(part, default)
+                for part in result[self._slice]
+                if part
+            ]
+
+        if result == json_data:
+            return default
+        return result
+
+    @classmethod
+    def path_key(cls, path):
+        """
+        Returns a hashable key for the path, which may contain slices
+        """
+        if isinstance(path, slice):
+            return slice, path.start, path.stop, path.step
+        if isinstance(path, (list, tuple)):
+            return tuple(cls.path_key(part) for part in path)
+        return path
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+
+    Copyright (C) 2024-present plugin.video.youtube
+
+    SPDX-License-Identifier: GPL-2.0-only
+    See LICENSES/GPL-2.0-only for more information.
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+from threading import Lock
+from time import gmtime, strftime, time
+from uuid import uuid4
+
+
+class QuotaLedger(object):
+    """
+    Local record of the YouTube Data API v3 quota units used by an API key
+    over the current quota day, stored in the data cache.
+
+    Units used are accumulated in memory and written to a row of the data cache
+    that only this ledger writes to, so concurrent plugin and service
+    processes do not overwrite each other's usage. The total usage is the sum
+    of the rows of all ledgers for the quota day.
+    """
+
+    DAILY_LIMIT = 10000
+    LOW_BUDGET = 0.1
+
+    # Quota is reset at midnight Pacific Time. DST is not accounted for.
+    _DAY_OFFSET = -8 * 60 * 60
+
+    # https://developers.google.com/youtube/v3/determine_quota_cost
+    _READ_COST = 1
+    _WRITE_COST = 50
+    _COSTS = {
+        'search': 100,
+    }
+
+    _lock = Lock()
+
+    def __init__(self, context, key_hash, daily_limit=DAILY_LIMIT):
+        self._context = context
+        self._key_prefix = 'quota,{0},'.format(key_hash)
+        self._ledger_id = uuid4().hex
+        self._daily_limit = daily_limit
+        self._usage = None
+        self._others_used = None
+
+    @classmethod
+    def get_cost(cls, method, path):
+        path = path.strip('/')
+        if path in cls._COSTS:
+            return cls._COSTS[path]
+        if method == 'GET':
+            return cls._READ_COST
+        return cls._WRITE_COST
+
+    def _today(self):
+        return strftime('%Y-%m-%d', gmtime(time() + self._DAY_OFFSET))
+
+    def _get_own_usage(self, today):
+        usage = self._usage
+        if not usage or usage['date'] != today:
+            usage = self._usage = {
+                'date': today,
+                'used': 0,
+                'endpoints': {},
+            }
+            self._others_used = None
+        return usage
+
+    def get_usage(self):
+        """
+        Returns a dict of the quota day, the total units used, and the units
+        used by each endpoint, by all ledgers for the API key
+        """
+        today = self._today()
+        prefix = ''.join((self._key_prefix, today, ','))
+        own_key = prefix + self._ledger_id
+        with self._lock:
+            own_usage = self._get_own_usage(today)
+            used = own_usage['used']
+            endpoints = dict(own_usage['endpoints'])
+            others_used = 0
+            data_cache = self._context.get_data_cache()
+            rows = data_cache.get_items_like(prefix + '%')
+            for key in rows:
+                if key == own_key:
+                    continue
+                usage = rows[key]['value']
+                others_used += usage['used']
+                for endpoint, cost in usage['endpoints'].items():
+                    endpoints[endpoint] = endpoints.get(endpoint, 0) + cost
+            self._others_used = others_used
+        return {
+            'date': today,
+            'used': used + others_used,
+            'endpoints': endpoints,
+        }
+
+    def record(self, method, path):
+        """
+        Records the cost of a request and returns an estimate of the remaining
+        units, using the usage of other ledgers as last read by get_usage
+        """
+        cost = self.get_cost(method, path)
+        endpoint = ' '.join((method, path.strip('/')))
+        today = self._today()
+        with self._lock:
+            usage = self._get_own_usage(today)
+            usage['used'] += cost
+            endpoints = usage['endpoints']
+            endpoints[endpoint] = endpoints.get(endpoint, 0) + cost
+            self._context.get_data_cache().set_item(
+                ''.join((self._key_prefix, today, ',', self._ledger_id)),
+                usage,
+            )
+            used = usage['used']
+            others_used = self._others_used
+        if others_used is None:
+            return self.remaining()
+        return self._daily_limit - (used + others_used)
+
+    def remaining(self):
+        return self._daily_limit - self.get_usage()['used']
+
+    def is_low(self, cost=0):
+        return (self.remaining() - cost
+                < self._daily_limit * self.LOW_BUDGET)
@@ -9,12 +9,18 @@
 
 from __future__ import absolute_import, division, unicode_literals
 
+from .json_path import JsonPath
 from ..youtube_exceptions import YouTubeException
+from ...kodion.compatibility import string_type
 from ...kodion.network import BaseRequestsClass
 from ...kodion.utils import merge_dicts
 
 
 class YouTubeRequestClient(BaseRequestsClass):
+    _client_templates = {}
+    _json_paths = {}
+    _json_path_values = {}
+
     _ANDROID_PARAMS = 'CgIIAdgDAQ=='
     # yt-dlp has chosen the following value, but this results in the android
     # player response returning unexpected details sometimes. To be investigated
@@ -308,57 +314,115 @@ class YouTubeRequestClient(BaseRequestsClass):
         if not json_data or not path:
             return default
 
-        result = json_data
-        for idx, keys in enumerate(path):
-            if not isinstance(result, (dict, list, tuple)):
-                return default
-
-            if isinstance(keys, slice):
-                return [
-                    cls.json_traverse(part, path[idx + 1:], default=default)
-                    for part in result[keys]
-                    if part
-                ]
+        if isinstance(path, JsonPath):
+            return path(json_data, default)
 
-            if not isinstance(keys, (list, tuple)):
-                keys = [keys]
+        # Compiled paths are cached by identity, as paths are usually constant
+        # tuples, and then by value for paths that are created on each call
+        json_paths = cls._json_paths
+        cached = json_paths.get(id(path))
+        if cached and cached[0] is path:
+            return cached[1](json_data, default)
 
-            for key in keys:
-                if isinstance(key, (list, tuple)):
-                    new_result = cls.json_traverse(result, key, default=default)
-                    if new_result:
-                        result = new_result
-                        break
-                    continue
-
-                try:
-                    result = result[key]
-                except (KeyError, IndexError):
-                    continue
-                break
-            else:
-                return default
-
-        if result == json_data:
-            return default
-        return result
+        path_key = JsonPath.path_key(path)
+        json_path_values = cls._json_path_values
+        json_path = json_path_values.get(path_key)
+        if not json_path:
+            if len(json_path_values) >= 128:
+                json_path_values.clear()
+            json_path = json_path_values[path_key] = JsonPath(path)
+        if len(json_paths) >= 128:
+            json_paths.clear()
+        json_paths[id(path)] = (path, json_path)
+        return json_path(json_data, default)
 
     @classmethod
-    def build_client(cls, client_name=None, data=None):
-        templates = {}
+    def _get_client_template(cls, client_name):
+        """
+        Returns a tuple of the client definition merged with the common client
+        definition, the paths of the string templates it contains, and the
+        paths of the keys the client does not allow to be set. Templates are
+        cached for each client and language/region, and must not be modified.
+        """
+        clients = cls.CLIENTS
+        common_client = clients['_common']['json']['context']['client']
+        template_id = (id(clients),
+                       client_name,
+                       common_client['hl'],
+                       common_client['gl'])
+        template = cls._client_templates.get(template_id)
+        if template:
+            return template
 
         client = None
         if client_name:
-            client = cls.CLIENTS.get(client_name)
+            client = clients.get(client_name)
             if client and client.get('_disabled'):
-                return None
+                cls._client_templates[template_id] = (None, None, None)
+                return cls._client_templates[template_id]
         if not client:
             client = YouTubeRequestClient.CLIENTS['web']
-        client = client.copy()
+
+        template = merge_dicts(clients['_common'], client)
+        template = cls._client_templates[template_id] = (
+            template,
+            tuple(cls._find_paths(
+                template,
+                lambda value: isinstance(value, string_type) and '{' in value,
+            )),
+            frozenset(path for path, _ in cls._find_paths(
+                client,
+                lambda value: value is KeyError,
+            )),
+        )
+        return template
+
+    @classmethod
+    def _find_paths(cls, values, match, path=()):
+        for key, value in values.items():
+            key_path = path + (key,)
+            if isinstance(value, dict):
+                for found in cls._find_paths(value, match, key_path):
+                    yield found
+            elif match(value):
+                yield key_path, value
+
+    @classmethod
+    def _overlay(cls, values, data, masked, path=()):
+        """
+        Returns a copy of values updated with the contents of data. Nested
+        dicts are only copied where data changes their contents.
+        """
+        values = values.copy()
+        for key, value in data.items():
+            key_path = path + (key,)
+            if key_path in masked:
+                continue
+            if value is KeyError:
+                values.pop(key, None)
+                continue
+            current_value = values.get(key)
+            if isinstance(value, dict) and isinstance(current_value, dict):
+                value = cls._overlay(current_value, value, masked, key_path)
+            values[key] = value
+        return values
+
+    @classmethod
+    def build_client(cls, client_name=None, data=None):
+        template, templates, masked = cls._get_client_template(client_name)
+        if not template:
+            return None
 
         if data:
-            client = merge_dicts(client, data)
-        client = merge_dicts(cls.CLIENTS['_common'], client, templates)
+            client = cls._overlay(template, data, masked)
+        else:
+            client = template.copy()
+        # Callers can modify the top level dicts of the client, so these are
+        # always copied. Nested dicts that are unchanged are shared with the
+        # template.
+        for key, value in template.items():
+            if isinstance(value, dict) and client.get(key) is value:
+                client[key] = value.copy()
         client['_name'] = client_name
 
         try:
@@ -369,8 +433,20 @@ class YouTubeRequestClient(BaseRequestsClass):
         except KeyError:
             pass
 
-        for values, template_id, template in templates.values():
-            if template_id in values:
-                values[template_id] = template.format(**client)
+        for path, value in templates:
+            values = client
+            shared = template
+            for key in path[:-1]:
+                shared = shared[key]
+                next_values = values.get(key)
+                if not isinstance(next_values, dict):
+                    break
+                if next_values is shared:
+                    next_values = values[key] = next_values.copy()
+                values = next_values
+            else:
+                key = path[-1]
+                if values.get(key) is value:
+                    values[key] = value.format(**client)
 
         return client
@@ -10,22 +10,24 @@
 
 from __future__ import absolute_import, division, unicode_literals
 
-import threading
+import json
 import xml.etree.ElementTree as ET
 from copy import deepcopy
-from functools import partial
+from hashlib import md5
+from heapq import heapify, heappop, heapreplace
 from itertools import chain, islice
+from operator import itemgetter
 from random import randint
 
 from .login_client import LoginClient
+from .quota import QuotaLedger
 from ..helper.video_info import VideoInfo
 from ..youtube_exceptions import InvalidJSON, YouTubeException
-from ...kodion.compatibility import cpu_count, string_type, to_str
+from ...kodion.compatibility import string_type
 from ...kodion.utils import (
-    current_system_version,
+    BoundedExecutor,
     datetime_parser,
     strip_html_from_text,
-    to_unicode,
 )
 
 
@@ -128,13 +130,44 @@ class YouTube(LoginClient):
         },
     }
 
+    # Time to live, in seconds, of cached InnerTube responses by endpoint
+    INNERTUBE_CACHE_TTL = {
+        'browse': 10 * 60,
+        'next': 60 * 60,
+    }
+
+    # v3 API endpoints that use conditional requests. Responses are stored in
+    # the data cache, so this is limited to listings that are requested
+    # repeatedly and are not already cached by the ResourceManager
+    CONDITIONAL_REQUEST_ENDPOINTS = frozenset((
+        'activities',
+        'channelSections',
+        'playlistItems',
+        'subscriptions',
+    ))
+
     def __init__(self, context, **kwargs):
         self._context = context
         if 'items_per_page' in kwargs:
             self._max_results = kwargs.pop('items_per_page')
+        self._quota = None
 
         super(YouTube, self).__init__(**kwargs)
 
+    def get_quota(self):
+        if self._quota is None:
+            config = self._config
+            key_hash = self._context.get_access_manager().calc_key_hash(
+                key=config.get('key', ''),
+                id=config.get('id', ''),
+                secret=config.get('secret', ''),
+            )
+            self._quota = QuotaLedger(self._context, key_hash)
+        return self._quota
+
+    def quota_low(self, cost=0):
+        return self.get_quota().is_low(cost)
+
     def get_max_results(self):
         return self._max_results
 
@@ -195,11 +228,17 @@ class YouTube(LoginClient):
         self.request(url, params=params, headers=headers,
                      error_msg='Failed to update watch history')
 
-    def get_video_streams(self, context, video_id):
+    def get_video_streams(self,
+                          context,
+                          video_id,
+                          use_cache=True,
+                          prefetch=False):
         video_info = VideoInfo(context, access_token=self._access_token_tv,
                                language=self._language)
 
-        video_streams = video_info.load_stream_infos(video_id)
+        video_streams = video_info.load_stream_infos(video_id,
+                                                     use_cache=use_cache,
+                                                     prefetch=prefetch)
 
         # update title
         for video_stream in video_streams:
@@ -678,8 +717,7 @@ class YouTube(LoginClient):
             if original_ids is not None:
                 original_ids = list(original_ids)
 
-            running = 0
-            threads = []
+            executor = None
 
             for idx, item in enumerate(items):
                 if original_related is not None:
@@ -727,25 +765,20 @@ class YouTube(LoginClient):
                 if num_stored or depth <= 1:
                     continue
 
-                running += 1
-                thread = threading.Thread(
-                    target=threaded_get_related,
-                    args=(video_id, index_items, counts),
-                    kwargs={'item_store': item_store,
-                            'group': (group + 1),
-                            'depth': (depth - 1),
-                            'original_related': related,
-                            'original_channel': channel},
-                )
-                thread.daemon = True
-                threads.append(thread)
-                thread.start()
-
-            while running:
-                for thread in threads:
-                    thread.join(5)
-                    if not thread.is_alive():
-                        running -= 1
+                if not executor:
+                    executor = BoundedExecutor()
+                executor.submit(threaded_get_related,
+                                video_id,
+                                index_items,
+                                counts,
+                                item_store=item_store,
+                                group=(group + 1),
+                                depth=(depth - 1),
+                                original_related=related,
+                                original_channel=channel)
+
+            if executor:
+                executor.wait()
 
         index_items(cached, counts, original_ids=video_ids)
 
@@ -756,26 +789,13 @@ class YouTube(LoginClient):
             if related and 'items' in related:
                 func(related['items'][:items_per_page], *args, **kwargs)
 
-        running = 0
-        threads = []
         candidates = []
+        executor = BoundedExecutor()
         for video_id in video_ids:
             if video_id in counts['_related']:
                 continue
-            running += 1
-            thread = threading.Thread(
-                target=threaded_get_related,
-                args=(video_id, candidates.extend),
-            )
-            thread.daemon = True
-            threads.append(thread)
-            thread.start()
-
-        while running:
-            for thread in threads:
-                thread.join(5)
-                if not thread.is_alive():
-                    running -= 1
+            executor.submit(threaded_get_related, video_id, candidates.extend)
+        executor.wait()
 
         num_items = items_per_page * num_items * max_depth
         index_items(candidates[:num_items], counts,
@@ -1469,23 +1489,9 @@ class YouTube(LoginClient):
             subscription_filters = None
 
         page = page_token or 1
-        totals = {
-            'num': 0,
-            'start': -self._max_results,
-            'end': page * self._max_results,
-            'video_ids': set(),
-        }
-        totals['start'] += totals['end']
-
-        def _sort_by_date_time(item, limits):
-            video_id = item['id']
-            if video_id in limits['video_ids']:
-                return -1
-            limits['num'] += 1
-            limits['video_ids'].add(video_id)
-            return item['_timestamp']
+        end = page * self._max_results
+        start = end - self._max_results
 
-        channel_ids = []
         params = {
             'part': 'snippet',
             'maxResults': '50',
@@ -1495,13 +1501,13 @@ class YouTube(LoginClient):
 
         def _get_channels(_params=params):
             if not _params or 'complete' in _params:
-                return None, None
+                return None
             json_data = self.api_request(method='GET',
                                          path='subscriptions',
                                          params=_params,
                                          **kwargs)
             if not json_data:
-                return None, None
+                return None
 
             subs_page_token = json_data.get('nextPageToken')
             if subs_page_token:
@@ -1509,20 +1515,9 @@ class YouTube(LoginClient):
             else:
                 _params['complete'] = True
 
-            return 'list_list', [{
-                'channel_id': item['snippet']['resourceId']['channelId']
-            } for item in json_data.get('items', [])]
-
-        bookmarks = self._context.get_bookmarks_list().get_items()
-        if bookmarks:
-            channel_ids.extend([
-                {'channel_id': item_id}
-                for item_id, item in bookmarks.items()
-                if (isinstance(item, float)
-                    or getattr(item, 'get_channel_id', bool)())
-            ])
+            return [item['snippet']['resourceId']['channelId']
+                    for item in json_data.get('items', [])]
 
-        feeds = {}
         headers = {
             'Host': 'www.youtube.com',
             'Connection': 'keep-alive',
@@ -1538,91 +1533,155 @@ class YouTube(LoginClient):
             'Accept-Language': 'en-US,en;q=0.7,de;q=0.3'
         }
 
-        def _get_feed_cache(channel_id, _cache=cache, _refresh=refresh):
-            cached = _cache.get_item(channel_id)
-            if cached:
-                feed_details = cached['value']
-                _refresh = _refresh or cached['age'] > _cache.ONE_HOUR
-            else:
-                feed_details = {
-                    'channel_name': None,
-                    'cached_items': None,
-                }
-                _refresh = True
-
-            if _refresh:
-                feed_details['refresh'] = True
-
-            return 'dict_dict_dict', (channel_id, feed_details)
-
-        def _get_feed(channel_id, _headers=headers):
-            return 'dict_dict_dict', (channel_id, {
-                'content': self.request(
-                    'https://www.youtube.com/feeds/videos.xml?channel_id='
-                    + channel_id,
-                    headers=_headers,
-                ),
-                'refresh': True,
-            })
-
         namespaces = {
             'atom': 'http://www.w3.org/2005/Atom',
             'yt': 'http://www.youtube.com/xml/schemas/2015',
             'media': 'http://search.yahoo.com/mrss/',
         }
 
+        def _parse_feed(response, channel_id, newest=0, _ns=namespaces):
+            entry_tag = '{{{atom}}}entry'.format(**_ns)
+            title_tag = '{{{atom}}}title'.format(**_ns)
+            video_id_path = 'yt:videoId'
+            published_path = 'atom:published'
+            channel_name = None
+            feed_items = []
+
+            raw = response.raw
+            raw.decode_content = True
+            in_entry = False
+            try:
+                for event, elem in ET.iterparse(raw, events=('start', 'end')):
+                    tag = elem.tag
+                    if event == 'start':
+                        if tag == entry_tag:
+                            in_entry = True
+                        continue
+                    if tag == entry_tag:
+                        in_entry = False
+                        timestamp = datetime_parser.since_epoch(
+                            datetime_parser.strptime(
+                                elem.findtext(published_path, '', _ns)
+                            )
+                        )
+                        # Entries are ordered newest first, stop at the
+                        # first entry that is older than the cached items
+                        if timestamp < newest:
+                            break
+                        feed_items.append({
+                            'kind': 'youtube#video',
+                            'id': elem.findtext(video_id_path, '', _ns),
+                            'snippet': {
+                                'channelId': channel_id,
+                            },
+                            '_timestamp': timestamp,
+                            '_partial': True,
+                        })
+                        elem.clear()
+                    elif (not in_entry and channel_name is None
+                          and tag == title_tag):
+                        channel_name = (elem.text or '').lower().replace(',',
+                                                                         '')
+            except ET.ParseError as exc:
+                self._context.log_error('Unable to parse feed: |{id}| {exc}'
+                                        .format(id=channel_id, exc=exc))
+            finally:
+                # Read any remaining data to return the connection to the pool
+                raw.read()
+                response.close()
+            return channel_name, feed_items
+
+        def _get_feed(channel_id,
+                      _headers=headers,
+                      _cache=cache,
+                      _refresh=refresh):
+            cached = _cache.get_item(channel_id)
+            if cached:
+                feed_details = cached['value']
+                if not _refresh and cached['age'] <= _cache.ONE_HOUR:
+                    return channel_id, feed_details
+            else:
+                feed_details = {}
+
+            response = self.request(
+                'https://www.youtube.com/feeds/videos.xml?channel_id='
+                + channel_id,
+                headers=_headers,
+                validators=feed_details.get('validators'),
+                stream=True,
+            )
+            if response is None:
+                pass
+            elif response.status_code == 304:
+                response.close()
+                feed_details['not_modified'] = True
+            else:
+                channel_name, feed_items = _parse_feed(
+                    response,
+                    channel_id,
+                    feed_details.get('newest') or 0,
+                )
+                if channel_name is not None:
+                    feed_details['channel_name'] = channel_name
+                feed_details['feed_items'] = feed_items
+                feed_details['validators'] = self.get_validators(response)
+            return channel_id, feed_details
+
+        def _merge_feed(feed_items, cached_items, newest, limit=1000):
+            """
+            Merges newly parsed feed items into the cached items of a channel.
+            Cached items are stored newest first, and new items are no older
+            than the newest cached item, so only cached items at that time
+            can be duplicates of new items.
+            """
+            feed_items.sort(key=itemgetter('_timestamp'), reverse=True)
+            if not cached_items:
+                return feed_items[:limit]
+            if not newest:
+                newest = cached_items[0]['_timestamp']
+            seen = set()
+            for item in cached_items:
+                if item['_timestamp'] < newest:
+                    break
+                seen.add(item['id'])
+            merged = []
+            for item in feed_items:
+                if item['id'] not in seen:
+                    seen.add(item['id'])
+                    merged.append(item)
+            merged.extend(islice(cached_items, limit - len(merged)))
+            return merged
+
         def _parse_feeds(feeds,
-                         encode=not current_system_version.compatible(19, 0),
                          filters=subscription_filters,
-                         _ns=namespaces,
                          _cache=cache):
             all_items = {}
             new_cache = {}
             for channel_id, feed in feeds.items():
                 channel_name = feed.get('channel_name')
                 cached_items = feed.get('cached_items')
-                refresh_feed = feed.get('refresh')
-                content = feed.get('content')
-
-                if refresh_feed and content:
-                    content.encoding = 'utf-8'
-                    content = to_unicode(content.content).replace('\n', '')
-
-                    root = ET.fromstring(to_str(content) if encode else content)
-                    channel_name = (root.findtext('atom:title', '', _ns)
-                                    .lower().replace(',', ''))
-                    feed_items = [{
-                        'kind': 'youtube#video',
-                        'id': item.findtext('yt:videoId', '', _ns),
-                        'snippet': {
-                            'channelId': channel_id,
-                        },
-                        '_timestamp': datetime_parser.since_epoch(
-                            datetime_parser.strptime(
-                                item.findtext('atom:published', '', _ns)
-                            )
-                        ),
-                        '_partial': True,
-                    } for item in root.findall('atom:entry', _ns)]
-                else:
-                    feed_items = []
+                feed_items = feed.get('feed_items')
+                validators = feed.get('validators')
 
                 if feed_items:
-                    if cached_items:
-                        feed_items.extend(cached_items)
-                    feed_limits = {
-                        'num': 0,
-                        'video_ids': set(),
-                    }
-                    feed_items.sort(reverse=True,
-                                    key=partial(_sort_by_date_time,
-                                                limits=feed_limits))
-                    feed_items = feed_items[:min(1000, feed_limits['num'])]
+                    feed_items = _merge_feed(feed_items,
+                                             cached_items,
+                                             feed.get('newest'))
                     new_cache[channel_id] = {
                         'channel_name': channel_name,
                         'cached_items': feed_items,
+                        'newest': feed_items[0]['_timestamp'],
+                        'validators': validators,
                     }
                 elif cached_items:
+                    # Update age and validators of unchanged cached items
+                    if feed_items is not None or feed.get('not_modified'):
+                        new_cache[channel_id] = {
+                            'channel_name': channel_name,
+                            'cached_items': cached_items,
+                            'newest': cached_items[0]['_timestamp'],
+                            'validators': validators,
+                        }
                     feed_items = cached_items
                 else:
                     continue
@@ -1638,174 +1697,83 @@ class YouTube(LoginClient):
 
             if new_cache:
                 _cache.set_items(new_cache)
-            return list(chain.from_iterable(all_items.values()))
-
-        def _threaded_fetch(kwargs,
-                            output,
-                            worker,
-                            threads,
-                            pool_id,
-                            dynamic,
-                            input_wait,
-                            **_kwargs):
-            while not threads['balance'].is_set():
-                if kwargs is True:
-                    _kwargs = {}
-                elif kwargs:
-                    _kwargs = kwargs.pop()
-                elif input_wait:
-                    input_wait.acquire(True)
-                    input_wait.release()
-                    if kwargs:
-                        continue
-                    break
-                else:
-                    break
+            return list(all_items.values())
 
-                try:
-                    output_type, _output = worker(**_kwargs)
-                except Exception as exc:
-                    self._context.log_error('threaded_fetch error: |{exc}|'
-                                            .format(exc=exc))
-                    continue
+        executor = BoundedExecutor()
+        tasks = []
+        channel_ids = set()
 
-                if not output_type:
-                    break
-                if output_type == 'value_dict':
-                    output[_output[0]] = _output[1]
-                elif output_type == 'dict_dict':
-                    output.update(_output)
-                elif output_type == 'value_list':
-                    output.append(_output)
-                elif output_type == 'list_list':
-                    output.extend(_output)
-                elif output_type == 'value_list_dict':
-                    if _output[0] not in output:
-                        output[_output[0]] = []
-                    output[_output[0]].append(_output[1])
-                elif output_type == 'list_list_dict':
-                    if _output[0] not in output:
-                        output[_output[0]] = []
-                    output[_output[0]].extend(_output[1])
-                elif output_type == 'dict_dict_dict':
-                    if _output[0] not in output:
-                        output[_output[0]] = {}
-                    output[_output[0]].update(_output[1])
-            else:
-                threads['balance'].clear()
+        def _submit(_channel_ids):
+            for channel_id in _channel_ids:
+                if channel_id not in channel_ids:
+                    channel_ids.add(channel_id)
+                    tasks.append(executor.submit(_get_feed, channel_id))
 
-            thread = threading.current_thread()
-            threads['available'].release()
-            if dynamic:
-                threads['pool_counts'][pool_id] -= 1
-            threads['pool_counts']['all'] -= 1
-            threads['current'].discard(thread)
-
-        try:
-            num_cores = cpu_count() or 1
-        except NotImplementedError:
-            num_cores = 1
-        max_threads = min(32, 2 * (num_cores + 4))
-        threads = {
-            'max': max_threads,
-            'available': threading.Semaphore(max_threads),
-            'current': set(),
-            'pool_counts': {
-                'all': 0,
-            },
-            'balance': threading.Event(),
-        }
-        payloads = [
-            {
-                'pool_id': 1,
-                'kwargs': True,
-                'output': channel_ids,
-                'worker': _get_channels,
-                'threads': threads,
-                'limit': 1,
-                'dynamic': False,
-                'input_wait': None,
-            },
-        ] if logged_in else []
-        payloads.extend((
-            {
-                'pool_id': 2,
-                'kwargs': channel_ids,
-                'output': feeds,
-                'worker': _get_feed_cache,
-                'threads': threads,
-                'limit': 1,
-                'dynamic': False,
-                'input_wait': threading.Lock(),
-            },
-            {
-                'pool_id': 3,
-                'kwargs': channel_ids,
-                'output': feeds,
-                'worker': _get_feed,
-                'threads': threads,
-                'limit': None,
-                'dynamic': True,
-                'input_wait': threading.Lock(),
-            },
-        ))
-        while 1:
-            for payload in payloads:
-                pool_id = payload['pool_id']
-                if pool_id in threads['pool_counts']:
-                    current_num = threads['pool_counts'][pool_id]
-                else:
-                    current_num = threads['pool_counts'][pool_id] = 0
-
-                input_wait = payload['input_wait']
-                if payload['kwargs']:
-                    if input_wait and input_wait.locked():
-                        input_wait.release()
-                else:
-                    continue
-
-                available = threads['max'] - threads['pool_counts']['all']
-                limit = payload['limit']
-                if limit:
-                    if current_num >= limit:
-                        continue
-                    if not available:
-                        threads['balance'].set()
-                elif not available:
-                    continue
+        bookmarks = self._context.get_bookmarks_list().get_items()
+        if bookmarks:
+            _submit([
+                item_id
+                for item_id, item in bookmarks.items()
+                if (isinstance(item, float)
+                    or getattr(item, 'get_channel_id', bool)())
+            ])
 
-                thread = threading.Thread(
-                    target=_threaded_fetch,
-                    kwargs=payload,
-                )
-                thread.daemon = True
-                threads['current'].add(thread)
-                threads['pool_counts'][pool_id] += 1
-                threads['pool_counts']['all'] += 1
-                threads['available'].acquire(True)
-                thread.start()
-
-            if not threads['current']:
+        # Feeds are fetched by the executor while the subscriptions are paged
+        while logged_in:
+            try:
+                subscriptions = _get_channels()
+            except Exception as exc:
+                self._context.log_error('Unable to get subscriptions: |{exc}|'
+                                        .format(exc=exc))
+                subscriptions = None
+            if not subscriptions:
                 break
+            _submit(subscriptions)
 
-        for thread in threads['current']:
-            if thread and thread.is_alive():
-                thread.join(30)
-
-        items = _parse_feeds(feeds)
+        executor.wait()
+        feeds = {}
+        for task in tasks:
+            if not task.done():
+                continue
+            if task.error is not None:
+                self._context.log_error('Unable to get feed: |{exc}|'
+                                        .format(exc=task.error))
+                continue
+            if task.value:
+                channel_id, feed_details = task.value
+                feeds[channel_id] = feed_details
 
-        # filter, sorting by publish date and trim
-        if items:
-            items.sort(reverse=True,
-                       key=partial(_sort_by_date_time,
-                                   limits=totals))
-        else:
+        channel_items = _parse_feeds(feeds)
+        if not channel_items:
             return None
 
-        if totals['num'] > totals['end']:
+        # k-way merge of the per channel lists, which are all sorted by
+        # publish date, stopping after the first item of the next page
+        heap = [
+            (-items[0]['_timestamp'], idx, 0)
+            for idx, items in enumerate(channel_items)
+            if items
+        ]
+        heapify(heap)
+        video_ids = set()
+        items = []
+        while heap and len(items) <= end:
+            _, idx, pos = heap[0]
+            channel = channel_items[idx]
+            item = channel[pos]
+            pos += 1
+            if pos < len(channel):
+                heapreplace(heap, (-channel[pos]['_timestamp'], idx, pos))
+            else:
+                heappop(heap)
+            if item['id'] not in video_ids:
+                video_ids.add(item['id'])
+                items.append(item)
+
+        if len(items) > end:
             v3_response['nextPageToken'] = page + 1
-        if totals['num'] > totals['start']:
-            items = items[totals['start']:min(totals['num'], totals['end'])]
+        if len(items) > start:
+            items = items[start:end]
         else:
             return None
 
@@ -2087,21 +2055,75 @@ class YouTube(LoginClient):
         else:
             log_headers = None
 
+        if version == 3:
+            remaining = self.get_quota().record(method, path)
+            if remaining < 0:
+                self._context.log_warning('API quota exceeded: |{0}| units'
+                                          .format(remaining))
+        else:
+            remaining = None
+
         self._context.log_debug('API request:\n'
                                 'version: |{version}|\n'
                                 'method: |{method}|\n'
                                 'path: |{path}|\n'
                                 'params: |{params}|\n'
                                 'post_data: |{data}|\n'
-                                'headers: |{headers}|'
+                                'headers: |{headers}|\n'
+                                'quota remaining: |{remaining}|'
                                 .format(version=version,
                                         method=method,
                                         path=path,
                                         params=log_params,
                                         data=client.get('json'),
-                                        headers=log_headers))
+                                        headers=log_headers,
+                                        remaining=remaining))
+        data_cache = self._context.get_data_cache()
+        cache_ttl = (version != 3 and method == 'POST'
+                     and self.INNERTUBE_CACHE_TTL.get(client_data['_endpoint']))
+        if cache_ttl:
+            cache_key = self._get_response_cache_key(client)
+            if not self._context.get_param('refresh'):
+                response = data_cache.get_item(cache_key, cache_ttl)
+                if response:
+                    self._context.log_debug('API response: |cached|')
+                    return response
+
+        if (version == 3 and method == 'GET' and client_data['_endpoint']
+                in self.CONDITIONAL_REQUEST_ENDPOINTS):
+            request_cache = data_cache
+        else:
+            request_cache = None
+
         response = self.request(response_hook=self._response_hook,
                                 response_hook_kwargs=kwargs,
                                 error_hook=self._error_hook,
+                                cache=request_cache,
                                 **client)
+        # Error responses are passed through by the error hook as the
+        # response data, but only successful responses are cached
+        if (cache_ttl and response and isinstance(response, dict)
+                and 'error' not in response):
+            data_cache.set_item(cache_key, response)
         return response
+
+    @staticmethod
+    def _get_response_cache_key(client):
+        """
+        Creates a content addressed key from the request URL, normalised post
+        data, which includes the client details, and the logged in user
+        """
+        md5_hash = md5()
+        md5_hash.update(client['url'].encode('utf-8'))
+        params = client.get('params')
+        if params:
+            md5_hash.update(repr(sorted(params.items())).encode('utf-8'))
+        post_data = client.get('json')
+        if post_data:
+            md5_hash.update(json.dumps(post_data,
+                                       sort_keys=True,
+                                       separators=(',', ':')).encode('utf-8'))
+        headers = client.get('headers')
+        if headers and 'Authorization' in headers:
+            md5_hash.update(headers['Authorization'].encode('utf-8'))
+        return 'innertube,' + md5_hash.hexdigest()
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+
+    Copyright (C) 2024-present plugin.video.youtube
+
+    SPDX-License-Identifier: GPL-2.0-only
+    See LICENSES/GPL-2.0-only for more information.
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+from threading import Lock
+from time import time
+
+
+class ClientStats(object):
+    """
+    Record of the outcome of player requests made using each client, stored
+    in the data cache. Counts decay over time, so that clients that have
+    recently stopped working are tried last, and clients that start working
+    again recover their position.
+    """
+
+    OK = 'ok'
+    FAILED = 'failed'
+    # Age restricted and geo-blocked videos are unplayable regardless of
+    # whether the client is working, so these outcomes are recorded but do
+    # not count against the client
+    AGE_RESTRICTED = 'age'
+    GEO_BLOCKED = 'geo'
+    # The video may be unplayable rather than the client not working, so this
+    # outcome is only recorded, as a failure, if another client was able to
+    # play the same video
+    UNPLAYABLE = 'unplayable'
+
+    # Time in seconds for the weight of a recorded outcome to halve
+    HALF_LIFE = 24 * 60 * 60
+    # Minimum weight of recorded outcomes before a client can be demoted,
+    # i.e. at least two recent outcomes
+    MIN_WEIGHT = 1.5
+    # Clients with a success rate below this are tried after other clients
+    MIN_SUCCESS_RATE = 0.5
+
+    _cache_key = 'player_client_stats'
+    _lock = Lock()
+
+    def __init__(self, context):
+        self._context = context
+
+    def _decay(self, stats, now):
+        factor = 0.5 ** (max(now - stats['updated'], 0) / self.HALF_LIFE)
+        for outcome in (self.OK,
+                        self.FAILED,
+                        self.AGE_RESTRICTED,
+                        self.GEO_BLOCKED):
+            stats[outcome] *= factor
+        stats['updated'] = now
+        return stats
+
+    def get_stats(self):
+        """
+        Returns a dict of the decayed outcome counts and average latency of
+        each client
+        """
+        all_stats = self._context.get_data_cache().get_item(self._cache_key)
+        if not all_stats:
+            return {}
+        now = time()
+        return {
+            client_name: self._decay(stats, now)
+            for client_name, stats in all_stats.items()
+        }
+
+    def record(self, outcomes):
+        """
+        Records a sequence of (client_name, outcome, latency) tuples from the
+        player requests made for a single video
+        """
+        if any(outcome == self.OK for _, outcome, _ in outcomes):
+            outcomes = [
+                (client_name,
+                 self.FAILED if outcome == self.UNPLAYABLE else outcome,
+                 latency)
+                for client_name, outcome, latency in outcomes
+            ]
+        else:
+            outcomes = [
+                (client_name, outcome, latency)
+                for client_name, outcome, latency in outcomes
+                if outcome != self.UNPLAYABLE
+            ]
+        if not outcomes:
+            return
+        now = time()
+        with self._lock:
+            all_stats = self.get_stats()
+            for client_name, outcome, latency in outcomes:
+                stats = all_stats.get(client_name)
+                if not stats:
+                    stats = all_stats[client_name] = {
+                        self.OK: 0,
+                        self.FAILED: 0,
+                        self.AGE_RESTRICTED: 0,
+                        self.GEO_BLOCKED: 0,
+                        'latency': None,
+                        'updated': now,
+                    }
+                stats[outcome] += 1
+                if latency is not None:
+                    average = stats['latency']
+                    if average is None:
+                        stats['latency'] = latency
+                    else:
+                        # Exponentially weighted moving average
+                        stats['latency'] = average + (latency - average) / 8
+            self._context.get_data_cache().set_item(self._cache_key, all_stats)
+
+    def success_rate(self, stats):
+        weight = stats[self.OK] + stats[self.FAILED]
+        if weight < self.MIN_WEIGHT:
+            return None
+        return stats[self.OK] / weight
+
+    def get_order(self, client_names):
+        """
+        Returns a tuple of client_names reordered so that clients with a low
+        success rate are tried last, ordered by success rate. Other clients
+        keep their original order, as this determines which stream formats are
+        used.
+        """
+        all_stats = self.get_stats()
+        if not all_stats:
+            return tuple(client_names)
+
+        def _sort(item):
+            position, client_name = item
+            stats = all_stats.get(client_name)
+            rate = stats and self.success_rate(stats)
+            if rate is None or rate >= self.MIN_SUCCESS_RATE:
+                return 0, 0, position
+            return 1, -rate, position
+
+        return tuple(client_name
+                     for _, client_name in sorted(enumerate(client_names),
+                                                  key=_sort))
@@ -10,8 +10,15 @@
 
 from __future__ import absolute_import, division, unicode_literals
 
+from time import time
+
+from ...kodion.utils import BoundedExecutor, SingleFlight
+
 
 class ResourceManager(object):
+    _single_flight = SingleFlight()
+    _max_batch_threads = 10
+
     def __init__(self, provider, context):
         self._context = context
         fanart_type = context.get_param('fanart_type')
@@ -31,11 +38,61 @@ class ResourceManager(object):
         for i in range(0, len(input_list), n):
             yield input_list[i:i + n]
 
+    def _refresh_allowed(self):
+        """
+        Cached data is used even if a refresh was requested, when the
+        remaining API quota is low
+        """
+        if not self._context.get_param('refresh'):
+            return False
+        client = self._provider.get_client(self._context)
+        if client.quota_low():
+            self._context.log_debug('ResourceManager - API quota low,'
+                                    ' using cached data')
+            return False
+        return True
+
+    def _fetch(self, func, batch, *args, **kwargs):
+        """
+        Calls func with batch of IDs, sharing the result with any concurrent
+        identical request for the same batch from another thread
+        """
+        key = (func, tuple(batch), args, tuple(sorted(kwargs.items())))
+        return self._single_flight.run(key, func, batch, *args, **kwargs)
+
+    def _fetch_batches(self, func, ids, *args, **kwargs):
+        """
+        Calls func for each batch of 50 IDs using a bounded pool of threads.
+        Returns a list of the batch results in the same order as the batches.
+        The first exception raised by any batch is re-raised.
+        """
+        batches = list(self._list_batch(ids, n=50))
+        num_batches = len(batches)
+        log_debug = self._context.log_debug
+
+        def _fetch_batch(idx):
+            batch = batches[idx]
+            start_time = time()
+            result = self._fetch(func, batch, *args, **kwargs)
+            log_debug('ResourceManager.{name} - batch {idx}/{num}'
+                      ' of {size} IDs took {time:.3f}s'
+                      .format(name=func.__name__,
+                              idx=idx + 1,
+                              num=num_batches,
+                              size=len(batch),
+                              time=time() - start_time))
+            return result
+
+        if num_batches == 1:
+            return [_fetch_batch(0)]
+        executor = BoundedExecutor(max_workers=self._max_batch_threads)
+        return executor.map(_fetch_batch, range(num_batches), raise_exc=True)
+
     def get_channels(self, ids, defer_cache=False):
         client = self._provider.get_client(self._context)
         data_cache = self._context.get_data_cache()
         function_cache = self._context.get_function_cache()
-        refresh = self._context.get_param('refresh')
+        refresh = self._refresh_allowed()
         updated = []
         for channel_id in ids:
             if not channel_id:
@@ -49,6 +106,7 @@ class ResourceManager(object):
                 client.get_channel_by_username,
                 function_cache.ONE_DAY,
                 _refresh=refresh,
+                _stale_ok=True,
                 username=channel_id
             ) or {}
             items = data.get('items', [{'id': 'mine'}])
@@ -73,8 +131,7 @@ class ResourceManager(object):
                                     .format(ids=list(result)))
 
         if to_update:
-            new_data = [client.get_channels(list_of_50)
-                        for list_of_50 in self._list_batch(to_update, n=50)]
+            new_data = self._fetch_batches(client.get_channels, to_update)
             if not any(new_data):
                 new_data = None
         else:
@@ -132,7 +189,7 @@ class ResourceManager(object):
 
     def get_playlists(self, ids, defer_cache=False):
         ids = tuple(ids)
-        refresh = self._context.get_param('refresh')
+        refresh = self._refresh_allowed()
         if refresh:
             result = {}
         else:
@@ -147,8 +204,7 @@ class ResourceManager(object):
 
         if to_update:
             client = self._provider.get_client(self._context)
-            new_data = [client.get_playlists(list_of_50)
-                        for list_of_50 in self._list_batch(to_update, n=50)]
+            new_data = self._fetch_batches(client.get_playlists, to_update)
             if not any(new_data):
                 new_data = None
         else:
@@ -181,7 +237,7 @@ class ResourceManager(object):
         if not ids and not batch_id:
             return None
 
-        refresh = self._context.get_param('refresh')
+        refresh = self._refresh_allowed()
 
         if batch_id:
             ids = [batch_id[0]]
@@ -281,7 +337,7 @@ class ResourceManager(object):
                    suppress_errors=False,
                    defer_cache=False):
         ids = tuple(ids)
-        refresh = self._context.get_param('refresh')
+        refresh = self._refresh_allowed()
         if refresh:
             result = {}
         else:
@@ -297,11 +353,11 @@ class ResourceManager(object):
         if to_update:
             notify_and_raise = not suppress_errors
             client = self._provider.get_client(self._context)
-            new_data = [client.get_videos(list_of_50,
-                                          live_details,
-                                          notify=notify_and_raise,
-                                          raise_exc=notify_and_raise)
-                        for list_of_50 in self._list_batch(to_update, n=50)]
+            new_data = self._fetch_batches(client.get_videos,
+                                           to_update,
+                                           live_details,
+                                           notify=notify_and_raise,
+                                           raise_exc=notify_and_raise)
             if not any(new_data):
                 new_data = None
         else:
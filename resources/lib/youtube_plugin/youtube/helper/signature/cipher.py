@@ -11,31 +11,102 @@
 from __future__ import absolute_import, division, unicode_literals
 
 import re
-
-from .json_script_engine import JsonScriptEngine
+from hashlib import md5
 
 
 class Cipher(object):
-    def __init__(self, context, javascript):
+    """
+    Deciphers stream signatures using the operations performed by the
+    signature function of the player JavaScript. The operations are compiled
+    into a plan, a list of (operation, *arguments) actions, that is stored in
+    the data cache for each version of the player JavaScript.
+    """
+
+    # Plans already loaded or compiled by this process, by cache key
+    _plans = {}
+
+    def __init__(self, context, javascript_url='', javascript=None):
+        """
+        :param javascript_url: URL of the player JavaScript, used to identify
+                               the plan
+        :param javascript: player JavaScript, or a function that returns it.
+                           Only used if the plan has not already been compiled
+        """
         self._context = context
-        self._verify = context.get_settings().verify_ssl()
+        self._javascript_url = javascript_url
         self._javascript = javascript
+        self._plan = None
 
         self._object_cache = {}
 
     def get_signature(self, signature):
-        function_cache = self._context.get_function_cache()
-        json_script = function_cache.run(self._load_javascript,
-                                         function_cache.ONE_DAY,
-                                         javascript=self._javascript)
-
-        if json_script:
-            json_script_engine = JsonScriptEngine(json_script)
-            return json_script_engine.execute(signature)
+        plan = self._plan
+        if not plan:
+            plan = self._plan = self._get_plan()
+            # The signature can not be deciphered without a plan
+            if not plan:
+                return ''
+        return self._execute(plan, signature)
+
+    def _get_javascript(self):
+        javascript = self._javascript
+        if callable(javascript):
+            javascript = self._javascript = javascript()
+        if not javascript:
+            raise Exception('Player JavaScript not available')
+        return javascript
+
+    def _get_plan(self):
+        if self._javascript_url:
+            cache_id = self._javascript_url
+        else:
+            cache_id = self._get_javascript()
+        cache_key = 'cipher_plan,' + md5(cache_id.encode('utf-8')).hexdigest()
+
+        plan = self._plans.get(cache_key)
+        if plan is not None:
+            return plan
+
+        data_cache = self._context.get_data_cache()
+        cached = data_cache.get_item(cache_key, data_cache.ONE_DAY)
+        if cached and cached.get('plan'):
+            plan = cached['plan']
+        else:
+            plan = self._compile_plan(self._get_javascript())
+            self._context.log_debug('Cipher - compiled plan: |{0}|'
+                                    .format(plan))
+            # Plans that could not be compiled are not cached, so that
+            # compilation is attempted again for subsequent requests
+            if not plan:
+                return plan
+            data_cache.set_item(cache_key, {'plan': plan})
+        self._plans[cache_key] = plan
+        return plan
 
-        return ''
-
-    def _load_javascript(self, javascript):
+    @staticmethod
+    def _execute(plan, signature):
+        for action in plan:
+            func = action[0]
+            if func == 'list':
+                signature = list(signature)
+            elif func == 'join':
+                signature = ''.join(signature)
+            elif func == 'reverse':
+                signature = signature[::-1]
+            elif func == 'slice':
+                signature = signature[action[1]:action[2]]
+            elif func == 'splice':
+                del signature[action[1]:action[2]]
+            elif func == 'swap':
+                position = action[1]
+                first = signature[0]
+                signature[0] = signature[position % len(signature)]
+                signature[position] = first
+            else:
+                raise Exception('Unknown cipher action |{0}|'.format(func))
+        return signature
+
+    def _compile_plan(self, javascript):
         function_name = self._find_signature_function_name(javascript)
         if not function_name:
             raise Exception('Signature function not found')
@@ -44,19 +115,17 @@ class Cipher(object):
         function_parameter = _function[0].replace('\n', '').split(',')
         function_body = _function[1].replace('\n', '').split(';')
 
-        json_script = {'actions': []}
+        plan = []
         for line in function_body:
             # list of characters
             split_match = re.match(r'%s\s?=\s?%s.split\(""\)' % (function_parameter[0], function_parameter[0]), line)
             if split_match:
-                json_script['actions'].append({'func': 'list',
-                                               'params': ['%SIG%']})
+                plan.append(('list',))
 
             # return
             return_match = re.match(r'return\s+%s.join\(""\)' % function_parameter[0], line)
             if return_match:
-                json_script['actions'].append({'func': 'join',
-                                               'params': ['%SIG%']})
+                plan.append(('join',))
 
             # real object functions
             cipher_match = re.match(
@@ -74,34 +143,26 @@ class Cipher(object):
                 # get function from object
                 _function = self._get_object_function(object_name, function_name, javascript)
 
-                # try to find known functions and convert them to our json_script
+                # try to find known functions and convert them to plan actions
                 slice_match = re.match(r'[a-zA-Z]+.slice\((?P<a>\d+),[a-zA-Z]+\)', _function['body'][0])
                 if slice_match:
                     a = int(slice_match.group('a'))
-                    params = ['%SIG%', a, parameter[1]]
-                    json_script['actions'].append({'func': 'slice',
-                                                   'params': params})
+                    plan.append(('slice', a, parameter[1]))
 
                 splice_match = re.match(r'[a-zA-Z]+.splice\((?P<a>\d+),[a-zA-Z]+\)', _function['body'][0])
                 if splice_match:
                     a = int(splice_match.group('a'))
-                    params = ['%SIG%', a, parameter[1]]
-                    json_script['actions'].append({'func': 'splice',
-                                                   'params': params})
+                    plan.append(('splice', a, parameter[1]))
 
                 swap_match = re.match(r'var\s?[a-zA-Z]+=\s?[a-zA-Z]+\[0\]', _function['body'][0])
                 if swap_match:
-                    params = ['%SIG%', parameter[1]]
-                    json_script['actions'].append({'func': 'swap',
-                                                   'params': params})
+                    plan.append(('swap', parameter[1]))
 
                 reverse_match = re.match(r'[a-zA-Z].reverse\(\)', _function['body'][0])
                 if reverse_match:
-                    params = ['%SIG%']
-                    json_script['actions'].append({'func': 'reverse',
-                                                   'params': params})
+                    plan.append(('reverse',))
 
-        return json_script
+        return plan
 
     @staticmethod
     def _find_signature_function_name(javascript):
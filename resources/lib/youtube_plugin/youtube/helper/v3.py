@@ -10,8 +10,6 @@
 
 from __future__ import absolute_import, division, unicode_literals
 
-from threading import Thread
-
 from .utils import (
     THUMB_TYPES,
     filter_videos,
@@ -25,6 +23,7 @@ from .utils import (
 from ...kodion import KodionException
 from ...kodion.constants import paths
 from ...kodion.items import CommandItem, DirectoryItem, NextPageItem, VideoItem
+from ...kodion.utils import BoundedExecutor
 
 
 def _process_list_response(provider, context, json_data, item_filter):
@@ -238,7 +237,6 @@ def _process_list_response(provider, context, json_data, item_filter):
                 'suppress_errors': True,
                 'defer_cache': True,
             },
-            'thread': None,
             'updater': update_video_infos,
             'upd_args': (
                 provider,
@@ -253,14 +251,12 @@ def _process_list_response(provider, context, json_data, item_filter):
                 'use_play_data': use_play_data,
                 'item_filter': item_filter,
             },
-            'complete': False,
             'defer': False,
         },
         2: {
             'fetcher': resource_manager.get_playlists,
             'args': (playlist_id_dict,),
             'kwargs': {'defer_cache': True},
-            'thread': None,
             'updater': update_playlist_infos,
             'upd_args': (
                 provider,
@@ -269,14 +265,12 @@ def _process_list_response(provider, context, json_data, item_filter):
                 channel_items_dict,
             ),
             'upd_kwargs': {'data': None},
-            'complete': False,
             'defer': False,
         },
         3: {
             'fetcher': resource_manager.get_channels,
             'args': (channel_id_dict,),
             'kwargs': {'defer_cache': True},
-            'thread': None,
             'updater': update_channel_infos,
             'upd_args': (
                 provider,
@@ -286,7 +280,6 @@ def _process_list_response(provider, context, json_data, item_filter):
                 channel_items_dict,
             ),
             'upd_kwargs': {'data': None},
-            'complete': False,
             'defer': False,
         },
         4: {
@@ -296,7 +289,6 @@ def _process_list_response(provider, context, json_data, item_filter):
                 'force': bool(channel_id_dict or playlist_id_dict),
                 'defer_cache': True,
             },
-            'thread': None,
             'updater': update_fanarts,
             'upd_args': (
                 provider,
@@ -304,18 +296,15 @@ def _process_list_response(provider, context, json_data, item_filter):
                 channel_items_dict,
             ),
             'upd_kwargs': {'data': None},
-            'complete': False,
             'defer': True,
         },
         5: {
             'fetcher': resource_manager.cache_data,
             'args': (),
             'kwargs': {},
-            'thread': None,
             'updater': None,
             'upd_args': (),
             'upd_kwargs': {},
-            'complete': False,
             'defer': 4,
         },
     }
@@ -329,45 +318,27 @@ def _process_list_response(provider, context, json_data, item_filter):
         resource['upd_kwargs']['data'] = data
         resource['updater'](*resource['upd_args'], **resource['upd_kwargs'])
 
-    remaining = len(resources)
-    deferred = sum(1 for resource in resources.values() if resource['defer'])
-    iterator = iter(resources.values())
-    while remaining:
-        try:
-            resource = next(iterator)
-        except StopIteration:
-            iterator = iter(resources.values())
-            resource = next(iterator)
-
-        if resource['complete']:
-            continue
-
+    # Resources are fetched in stages. Deferred resources are fetched after
+    # all other resources, or after the resource they are deferred to
+    def _get_stage(resource):
         defer = resource['defer']
+        if defer is True:
+            return 1
         if defer:
-            if remaining > deferred:
-                continue
-            if defer in resources and not resources[defer]['complete']:
-                continue
-            resource['defer'] = False
-
-        args = resource['args']
-        if args and not args[0]:
-            resource['complete'] = True
-            remaining -= 1
-            continue
-
-        thread = resource['thread']
-        if thread:
-            thread.join(5)
-            if not thread.is_alive():
-                resource['thread'] = None
-                resource['complete'] = True
-                remaining -= 1
-        else:
-            thread = Thread(target=_fetch, args=(resource,))
-            thread.daemon = True
-            thread.start()
-            resource['thread'] = thread
+            return _get_stage(resources[defer]) + 1
+        return 0
+
+    stages = {}
+    for resource in resources.values():
+        stages.setdefault(_get_stage(resource), []).append(resource)
+
+    executor = BoundedExecutor()
+    for stage in sorted(stages):
+        # Arguments may have been populated by resources of a previous stage
+        executor.map(_fetch, [
+            resource for resource in stages[stage]
+            if not resource['args'] or resource['args'][0]
+        ])
 
     return result
 
@@ -14,8 +14,12 @@ import json
 import os
 import random
 import re
+from copy import deepcopy
+from hashlib import md5
+from time import time
 from traceback import format_stack
 
+from .client_stats import ClientStats
 from .ratebypass import ratebypass
 from .signature.cipher import Cipher
 from .subtitles import Subtitles
@@ -32,14 +36,23 @@ from ...kodion.compatibility import (
     urlsplit,
     xbmcvfs,
 )
-from ...kodion.constants import TEMP_PATH, paths
+from ...kodion.constants import PLAY_PROMPT_SUBTITLES, TEMP_PATH, paths
 from ...kodion.network import get_connect_address
-from ...kodion.utils import make_dirs, redact_ip_from_url
+from ...kodion.utils import BoundedExecutor, make_dirs, redact_ip_from_url
 
 
 class VideoInfo(YouTubeRequestClient):
     BASE_PATH = make_dirs(TEMP_PATH)
 
+    # Cached stream lists are discarded this many seconds, plus the duration
+    # of the video, before the stream URLs expire
+    _STREAMS_EXPIRY_MARGIN = 5 * 60
+    _RE_EXPIRE = re.compile(r'[?&/]expire[=/](\d+)')
+
+    # Number of player requests, for the clients in priority order, that are
+    # sent concurrently. Set to 1 to try each client one after another.
+    _race_clients = 3
+
     FORMAT = {
         # === Non-DASH ===
         '5': {'container': 'flv',
@@ -591,6 +604,7 @@ class VideoInfo(YouTubeRequestClient):
         self._cipher = None
 
         self._selected_client = None
+        self._client_stats = ClientStats(context)
         client_selection = context.get_settings().client_selection()
 
         # Default client selection uses the Android or iOS client as the first
@@ -751,9 +765,176 @@ class VideoInfo(YouTubeRequestClient):
             return kwargs
         return yt_format
 
-    def load_stream_infos(self, video_id):
+    def load_stream_infos(self, video_id, use_cache=True, prefetch=False):
+        """
+        Returns the list of streams of video_id, using the cached stream list
+        if available and use_cache is True.
+        If prefetch is True, the stream list is only loaded to be cached for
+        later playback. Nothing is loaded if the stream list would not be
+        cached, as loading it could prompt for subtitle selection.
+        """
         self.video_id = video_id
-        return self._get_video_info()
+
+        # Stream lists are not cached if subtitles are selected when played,
+        # or if selection is overridden for this play. A prefetch must also not
+        # consume the override set for a pending play of another video.
+        prompt_subtitles = self._context.get_ui().get_property(
+            PLAY_PROMPT_SUBTITLES
+        )
+        if use_cache and (
+                self._context.get_settings().get_subtitle_selection()
+                == Subtitles.LANG_PROMPT
+                or prompt_subtitles == video_id
+                or (prefetch and prompt_subtitles)
+        ):
+            use_cache = False
+
+        if not use_cache:
+            if prefetch:
+                return []
+            stream_list, _ = self._get_video_info()
+            return stream_list
+
+        data_cache = self._context.get_data_cache()
+        cache_key = self._get_streams_cache_key(video_id)
+        cached = data_cache.get_item(cache_key)
+        if cached:
+            stream_list = self._restore_cached_streams(cached)
+            if stream_list:
+                self._context.log_debug(
+                    'Using cached stream list - '
+                    'video_id: {0}, expires in: {1}s'.format(
+                        video_id,
+                        int(cached['expires'] - time()),
+                    )
+                )
+                return stream_list
+            data_cache.remove(cache_key)
+
+        stream_list, expires = self._get_video_info()
+        if expires:
+            data_cache.set_item(cache_key, {
+                'expires': expires,
+                'mpd_modified': self._get_mpd_modified(),
+                'streams': deepcopy(stream_list),
+            })
+        return stream_list
+
+    def _get_streams_cache_key(self, video_id):
+        """
+        Stream lists depend on the login, language, subtitle language, client
+        and stream settings, and installed version of InputStream.Adaptive, so all of
+        these are used to identify a cached stream list
+        """
+        settings = self._context.get_settings()
+        md5_hash = md5()
+        for value in (
+                video_id,
+                self._access_token,
+                self._language_base,
+                self._prioritised_clients,
+                settings.age_gate(),
+                settings.use_isa(),
+                settings.use_mpd_videos(),
+                settings.mpd_video_qualities(),
+                settings.get_video_quality(),
+                settings.stream_features(),
+                settings.stream_select(),
+                settings.use_remote_history(),
+                settings.subtitle_download(),
+                settings.get_subtitle_selection(),
+                settings.get_language(),
+                self._context.get_subtitle_language(),
+                self._context.inputstream_adaptive_capabilities(),
+                get_connect_address(self._context),
+        ):
+            if isinstance(value, (set, frozenset)):
+                value = sorted(value)
+            md5_hash.update(repr(value).encode('utf-8'))
+        return 'streams,' + md5_hash.hexdigest()
+
+    def _get_mpd_modified(self):
+        filename = '.'.join((self.video_id, 'mpd'))
+        filepath = os.path.join(self.BASE_PATH, filename)
+        if not xbmcvfs.exists(filepath):
+            return None
+        return xbmcvfs.Stat(filepath).st_mtime()
+
+    def _restore_cached_streams(self, cached):
+        """
+        Returns the cached stream list if it has not expired, and the MPEG-DASH
+        manifest and subtitle files it uses have not been removed or replaced.
+        The playback stats URLs are updated with a new client playback nonce
+        (cpn).
+        """
+        if cached.get('expires', 0) <= time():
+            return None
+
+        # Stream lists are modified by the caller, so the cached copy, which
+        # may be held in memory, is not returned directly
+        stream_list = deepcopy(cached['streams'])
+        if any(stream.get('itag') == '9999' for stream in stream_list):
+            if cached['mpd_modified'] != self._get_mpd_modified():
+                return None
+
+        checked = set()
+        for stream in stream_list:
+            subtitles = stream.get('meta', {}).get('subtitles')
+            if not subtitles:
+                continue
+            for subtitle in subtitles:
+                if (subtitle in checked
+                        or subtitle.startswith(('http://', 'https://'))):
+                    continue
+                if not xbmcvfs.exists(subtitle):
+                    return None
+                checked.add(subtitle)
+
+        cpn = self._generate_cpn()
+        for stream in stream_list:
+            playback_stats = stream.get('playback_stats')
+            if not playback_stats:
+                continue
+            for key, url in playback_stats.items():
+                if url:
+                    playback_stats[key] = '&cpn='.join((
+                        url.rsplit('&cpn=', 1)[0], cpn
+                    ))
+        return stream_list
+
+    def _get_streams_expiry(self, streaming_data, video_details):
+        """
+        Returns the time when the stream URLs in the streaming data will have
+        expired before the video could be played through to the end.
+        Returns None if the expiry time of the URLs is not known.
+        """
+        urls = [streaming_data.get('dashManifestUrl'),
+                streaming_data.get('hlsManifestUrl')]
+        for fmt in (streaming_data.get('formats', [])
+                    + streaming_data.get('adaptiveFormats', [])):
+            if not fmt:
+                continue
+            url = fmt.get('url')
+            if not url and 'signatureCipher' in fmt:
+                url = parse_qs(fmt['signatureCipher']).get('url', [None])[0]
+            urls.append(url)
+
+        expires = [
+            int(found.group(1))
+            for found in (self._RE_EXPIRE.search(url) for url in urls if url)
+            if found
+        ]
+        if not expires:
+            return None
+
+        try:
+            duration = int(video_details.get('lengthSeconds', 0))
+        except ValueError:
+            duration = 0
+        expires = min(expires) - duration - self._STREAMS_EXPIRY_MARGIN
+        if expires <= time():
+            return None
+        return expires
 
     def _get_player_page(self, client_name='web', embed=False):
         if embed:
@@ -813,7 +994,7 @@ class VideoInfo(YouTubeRequestClient):
             return json.loads(found.group(1))
         return None
 
-    def _get_player_js(self):
+    def _get_player_js_url(self):
         data_cache = self._context.get_data_cache()
         cached = data_cache.get_item('player_js_url', data_cache.ONE_HOUR * 4)
         cached = cached and cached.get('url', '')
@@ -838,11 +1019,26 @@ class VideoInfo(YouTubeRequestClient):
 
         js_url = self._normalize_url(js_url)
         data_cache.set_item('player_js_url', {'url': js_url})
+        return js_url
+
+    def _get_player_js(self):
+        if self._player_js:
+            return self._player_js
+
+        js_url = self._get_player_js_url()
+        if not js_url:
+            return ''
 
+        # The player JavaScript is larger than the in-memory storage cache
+        # will hold, so it is always read from the database. The cipher keeps
+        # its own cache of the plan derived from it, so this is only needed
+        # when a new player version is used or to calculate the n parameter
+        data_cache = self._context.get_data_cache()
         js_cache_key = quote(js_url)
         cached = data_cache.get_item(js_cache_key, data_cache.ONE_HOUR * 4)
         cached = cached and cached.get('js')
         if cached:
+            self._player_js = cached
             return cached
 
         client_name = 'web'
@@ -865,6 +1061,7 @@ class VideoInfo(YouTubeRequestClient):
             return ''
 
         data_cache.set_item(js_cache_key, {'js': result})
+        self._player_js = result
         return result
 
     @staticmethod
@@ -1116,7 +1313,8 @@ class VideoInfo(YouTubeRequestClient):
                     details=''.join(format_stack())
                 ))
                 return None
-            data_cache.set_item(encrypted_signature, {'sig': signature})
+            if signature:
+                data_cache.set_item(encrypted_signature, {'sig': signature})
 
         if signature:
             url = '{0}&{1}={2}'.format(url, query_var, signature)
@@ -1215,6 +1413,84 @@ class VideoInfo(YouTubeRequestClient):
             return result['simpleText']
         return None
 
+    def _request_player(self, url, video_id, client):
+        """
+        Returns a tuple of the player response for the client, and the time
+        taken in seconds
+        """
+        start_time = time()
+        result = self.request(
+            url,
+            'POST',
+            response_hook=self._response_hook_json,
+            error_title='Player request failed',
+            error_hook=self._error_hook,
+            error_hook_kwargs={
+                'video_id': video_id,
+                'client': client['_name'],
+                'auth': bool(client.get('_access_token')),
+            },
+            **client
+        )
+        latency = time() - start_time
+        self._context.log_debug(
+            'Player request - '
+            'video_id: {0}, client: {1}, status: {2}, time: {3:.3f}s'.format(
+                video_id,
+                client['_name'],
+                result.get('playabilityStatus', {}).get('status'),
+                latency,
+            )
+        )
+        return result, latency
+
+    def _request_players(self, url, video_id, clients):
+        """
+        Generator of player responses, and the time taken to receive them,
+        for each client, in order. In race mode
+        the requests for the highest priority clients are sent concurrently,
+        and any requests that are still queued are cancelled once the
+        generator is closed.
+        """
+        if self._race_clients > 1:
+            executor = BoundedExecutor(max_workers=self._race_clients)
+            tasks = [
+                executor.submit(self._request_player, url, video_id, client)
+                for client in clients
+            ]
+            try:
+                for task in tasks:
+                    yield task.result() or ({}, None)
+            finally:
+                executor.cancel()
+        else:
+            for client in clients:
+                yield self._request_player(url, video_id, client)
+
+    @staticmethod
+    def _get_client_outcome(playability_status,
+                            status,
+                            reason,
+                            geo_reasons,
+                            wrong_video):
+        """
+        Returns the ClientStats outcome of a player request, or None if the
+        status is not affected by the client used e.g. an offline live stream
+        """
+        if status == 'OK':
+            return ClientStats.FAILED if wrong_video else ClientStats.OK
+        if (status in {'AGE_CHECK_REQUIRED',
+                       'AGE_VERIFICATION_REQUIRED',
+                       'CONTENT_CHECK_REQUIRED'}
+                or playability_status.get('desktopLegacyAgeGateReason')):
+            return ClientStats.AGE_RESTRICTED
+        if (status == 'UNPLAYABLE'
+                and any(why in reason for why in geo_reasons)):
+            return ClientStats.GEO_BLOCKED
+        if status in {'', 'UNPLAYABLE', 'LOGIN_REQUIRED', 'ERROR'}:
+            return ClientStats.UNPLAYABLE
+        return None
+
     def _get_video_info(self):
         video_info_url = 'https://www.youtube.com/youtubei/v1/player'
 
@@ -1234,8 +1510,22 @@ class VideoInfo(YouTubeRequestClient):
         if self._access_token:
             client_data['_access_token'] = self._access_token
 
+        prioritised_clients = self._client_stats.get_order(
+            self._prioritised_clients
+        )
+        if prioritised_clients != tuple(self._prioritised_clients):
+            self._context.log_debug('Player client order: |{0}|'
+                                    .format(', '.join(prioritised_clients)))
+        outcomes = []
+
+        start_time = time()
         while 1:
-            for client_name in self._prioritised_clients:
+            clients = list(filter(None, (
+                self.build_client(client_name, client_data)
+                for client_name in prioritised_clients
+            )))
+            results = self._request_players(video_info_url, video_id, clients)
+            for next_client, (result, latency) in zip(clients, results):
                 if status and status != 'OK':
                     self._context.log_warning(
                         'Failed to retrieve video info - '
@@ -1248,29 +1538,21 @@ class VideoInfo(YouTubeRequestClient):
                             reason or 'UNKNOWN',
                         )
                     )
-                client = self.build_client(client_name, client_data)
-                if not client:
-                    continue
-
-                result = self.request(
-                    video_info_url,
-                    'POST',
-                    response_hook=self._response_hook_json,
-                    error_title='Player request failed',
-                    error_hook=self._error_hook,
-                    error_hook_kwargs={
-                        'video_id': video_id,
-                        'client': client_name,
-                        'auth': bool(client.get('_access_token')),
-                    },
-                    **client
-                )
+                client = next_client
+                client_name = client['_name']
 
                 video_details = result.get('videoDetails', {})
                 playability_status = result.get('playabilityStatus', {})
                 status = playability_status.get('status', '').upper()
                 reason = playability_status.get('reason', '')
 
+                outcome = self._get_client_outcome(
+                    playability_status, status, reason, reasons,
+                    video_details and video_details.get('videoId') != video_id
+                )
+                if outcome:
+                    outcomes.append((client_name, outcome, latency))
+
                 if status in {'', 'AGE_CHECK_REQUIRED', 'UNPLAYABLE',
                               'CONTENT_CHECK_REQUIRED', 'LOGIN_REQUIRED',
                               'AGE_VERIFICATION_REQUIRED', 'ERROR'}:
@@ -1315,11 +1597,14 @@ class VideoInfo(YouTubeRequestClient):
             # Only attempt to remove Authorization header if clients iterable
             # was exhausted i.e. request attempted using all clients
             else:
+                results.close()
                 if '_access_token' in client_data:
                     del client_data['_access_token']
                     continue
             # Otherwise skip retrying clients without Authorization header
+            results.close()
             break
+        self._client_stats.record(outcomes)
 
         if status != 'OK':
             if status == 'LIVE_STREAM_OFFLINE':
@@ -1340,10 +1625,11 @@ class VideoInfo(YouTubeRequestClient):
 
         self._context.log_debug(
             'Retrieved video info - '
-            'video_id: {0}, client: {1}, auth: {2}'.format(
+            'video_id: {0}, client: {1}, auth: {2}, time: {3:.3f}s'.format(
                 video_id,
                 client_name,
                 bool(client.get('_access_token')),
+                time() - start_time,
             )
         )
         self._selected_client = client.copy()
@@ -1462,8 +1748,11 @@ class VideoInfo(YouTubeRequestClient):
         if any(True for fmt in all_fmts
                if fmt and 'url' not in fmt and 'signatureCipher' in fmt):
             self._context.log_debug('signatureCipher detected')
-            self._player_js = self._get_player_js()
-            self._cipher = Cipher(self._context, javascript=self._player_js)
+            # Player JavaScript is only loaded if the decipher plan for the
+            # current player version has not already been compiled
+            self._cipher = Cipher(self._context,
+                                  javascript_url=self._get_player_js_url(),
+                                  javascript=self._get_player_js)
 
         if 'dashManifestUrl' in streaming_data:
             manifest_url = streaming_data['dashManifestUrl']
@@ -1590,7 +1879,11 @@ class VideoInfo(YouTubeRequestClient):
         if not stream_list:
             raise YouTubeException('No streams found')
 
-        return stream_list
+        if is_live:
+            expires = None
+        else:
+            expires = self._get_streams_expiry(streaming_data, video_details)
+        return stream_list, expires
 
     def _process_stream_data(self, stream_data, default_lang_code='und'):
         _settings = self._context.get_settings()
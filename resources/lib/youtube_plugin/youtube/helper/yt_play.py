@@ -64,7 +64,11 @@ def play_video(provider, context):
         ui.clear_property(PLAY_FORCE_AUDIO)
 
         try:
-            video_streams = client.get_video_streams(context, video_id)
+            video_streams = client.get_video_streams(
+                context,
+                video_id,
+                use_cache=not (ask_for_quality or audio_only),
+            )
         except YouTubeException as exc:
             context.log_error('yt_play.play_video - {exc}:\n{details}'.format(
                 exc=exc, details=''.join(format_stack())
@@ -488,6 +488,7 @@ class Provider(AbstractProvider):
             json_data = function_cache.run(client.get_channel_by_username,
                                            function_cache.ONE_DAY,
                                            _refresh=params.get('refresh'),
+                                           _stale_ok=True,
                                            username=channel_id)
             if not json_data:
                 return False
@@ -857,10 +858,20 @@ class Provider(AbstractProvider):
                 )
                 result.append(live_item)
 
+        client = self.get_client(context)
         function_cache = context.get_function_cache()
-        json_data = function_cache.run(self.get_client(context).search,
-                                       function_cache.ONE_MINUTE * 10,
-                                       _refresh=params.get('refresh'),
+        # Prefer cached results if the remaining API quota is low, as each
+        # search request costs 100 units
+        if client.quota_low(cost=100):
+            context.log_debug('Search: API quota low, using cached results')
+            cache_duration = function_cache.ONE_DAY
+            refresh = False
+        else:
+            cache_duration = function_cache.ONE_MINUTE * 10
+            refresh = params.get('refresh')
+        json_data = function_cache.run(client.search,
+                                       cache_duration,
+                                       _refresh=refresh,
                                        q=search_text,
                                        search_type=search_type,
                                        event_type=event_type,